@@ -0,0 +1,135 @@
+"""Module to write the files read by Grafana safely and only when they change.
+
+Grafana scans the provisioned dashboards periodically, and it can read a file
+while the provisioning scripts are writing it. Every file written by the
+scripts goes through `writeIfChanged`, which writes a hidden temporary file in
+the same directory, flushes it to disk and renames it over the old one, so a
+reader sees either the old file or the new one, never part of it. A file whose
+content didn't change is not written at all, so its modification time stays the
+same and Grafana has nothing to reload. `linkIfChanged` replaces a file with a
+hard link in the same way.
+
+Functions
+=========
+"""
+import os
+import tempfile
+
+# Permissions of the new files, the same ones open() would give them
+_umask = os.umask(0)
+os.umask(_umask)
+_defaultMode = 0o666 & ~_umask
+
+
+def sameContent(path, content):
+    """Return True if a file exists and contains exactly `content`.
+    
+    Parameters
+    ==========
+    path : `str`
+        Path of the file to compare.
+    content : `bytes`
+        Expected content of the file.
+    """
+    try:
+        if os.stat(path).st_size != len(content):
+            return False
+        with open(path, 'rb') as stream:
+            return stream.read() == content
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+
+def writeIfChanged(path, content):
+    """Write `content` to a file atomically, unless it already contains it.
+    
+    The content is written to a temporary file in the same directory, which is
+    synced to disk and renamed to `path`. The mode of the old file is kept.
+    
+    Parameters
+    ==========
+    path : `str`
+        Path of the file to be written.
+    content : `bytes`
+        New content of the file.
+    
+    Returns
+    =======
+    written : `bool`
+        True if the file was written, False if it already had the same content.
+    
+    Raises
+    ======
+    PermissionError:
+        Raised if the script does not have permission to read the file or to write
+        to its directory.
+    FileNotFoundError:
+        Raised if the directory of the file doesn't exist.
+    """
+    if sameContent(path, content):
+        return False
+    directory, name = os.path.split(path)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = _defaultMode
+    
+    # Hidden, so that neither the scripts nor Grafana take it for a dashboard
+    fd, tmpPath = tempfile.mkstemp(prefix='.{}.'.format(name), suffix='.tmp', dir=directory or '.')
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(content)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.chmod(tmpPath, mode)
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+    return True
+
+
+def linkIfChanged(target, path):
+    """Make `path` a hard link to `target` atomically, unless it already is one.
+    
+    A hard link is created with a hidden temporary name in the directory of
+    `path` and renamed to `path`, so a reader sees either the old file or the
+    new one.
+    
+    Parameters
+    ==========
+    target : `str`
+        Path of the existing file.
+    path : `str`
+        Path of the link, it is replaced if it exists.
+    
+    Returns
+    =======
+    linked : `bool`
+        True if the link was created, False if `path` already was `target`.
+    
+    Raises
+    ======
+    OSError:
+        Raised if the link can't be created, for example if both paths are on
+        different file systems (``EXDEV``), or `target` has too many links
+        (``EMLINK``).
+    """
+    try:
+        if os.path.samefile(target, path):
+            return False
+    except FileNotFoundError:
+        pass
+    directory, name = os.path.split(path)
+    tmpPath = os.path.join(directory, '.{}.{}.tmp'.format(name, os.getpid()))
+    try:
+        os.remove(tmpPath)
+    except FileNotFoundError:
+        pass
+    os.link(target, tmpPath)
+    try:
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+    return True
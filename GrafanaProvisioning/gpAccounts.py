@@ -10,25 +10,58 @@ accounts in their list will be added to that organization with their given
 role. Note that accounts can belong to more than one organization, but must
 only be declared once in the YAML files.
 
-This script loads the basic info of all accounts and organizations into memory,
-and makes many requests to the API, so it can be a bit slow. Further testing is
-necessary to determine if, how and where it can be optimized.
+The script works in two phases. First it loads the desired state from the YAML
+configuration files and a snapshot of Grafana's state with bulk requests, and
+computes a `Plan` with the minimal ordered list of changes: create users,
+create orgs, add members and change roles. Then it applies the plan. When run
+with ``--dry-run`` the plan is only printed, without making any change.
+
+Organizations are independent from each other, so their members are loaded and
+their changes are applied concurrently by a `grafanaAsync.AsyncGrafana`, which
+makes up to ``orgWorkers`` requests at the same time, as configured in
+``config.yaml``. The accounts are created the same way. An error in one org doesn't stop the rest: errors
+are collected per org and a summary is printed at the end, in which case the
+script exits with a non-zero status. Likewise, an account that can't be created
+only skips the memberships of that account.
+
+After a successful run, a fingerprint of the configuration of each org (its
+members and their accounts) is stored with the ``id`` of the org in
+``.accountsFingerprints.json``. The next runs only review the orgs whose
+fingerprint changed or whose ``id`` is not the stored one (they were deleted or
+recreated in Grafana), so if nothing changed they only load the ids of the orgs,
+which ``gpProvision.py`` already did. Every
+``fullCheckSeconds``, or when run with ``--full``, all the orgs are reviewed
+again to correct any change made directly in Grafana.
 
 Functions
 =========
 """
+import os
+import sys
 import glob
+import json
+import time
+import hashlib
+import atexit
+import argparse
 import grafanaAPI as gapi
+from grafanaAsync import AsyncGrafana
+from runContext import RunContext
 import yamlUtility as yutil
+import fileUtility as futil
 
     
-def loadProvisionedOrgs(orgsDir):
+def loadProvisionedOrgs(orgsDir, orgFiles=None):
     """Load orgs from YAML config into dict indexed by name, storing user lists.
     
     Parameters
     ==========
     orgsDir : `str`
         Path to the directory where the orgs YAML files (symlinks) are stored.
+    orgFiles : `dict`, optional
+        Contents of ``org.yaml`` files that were already parsed, indexed by their
+        real path, as returned by `gpInputs.provisionInputs`. These files are not
+        read again.
     
     Returns
     =======
@@ -52,9 +85,13 @@ def loadProvisionedOrgs(orgsDir):
     ========
     yamlUtility.getYamlContent
     """
+    if orgFiles is None:
+        orgFiles = {}
     provOrgs = {}
     for orgFile in glob.glob('{}/[!_]*.yaml'.format(orgsDir)):
-        orgDict = yutil.getYamlContent(orgFile)
+        orgDict = orgFiles.get(os.path.realpath(orgFile))
+        if orgDict is None:
+            orgDict = yutil.getYamlContent(orgFile)
         numOrgs = len(orgDict)
         if numOrgs != 1:
             raise ValueError('There must be 1 org in the configuration file and {} were found. {}'
@@ -68,77 +105,20 @@ def loadProvisionedOrgs(orgsDir):
     return provOrgs
 
 
-def getOrCreateUser(account, user, password):
-    """Return a user's ID. If the account doesn't exist, create it.
-    
-    Query for accounts containing the login name inside their login, email or name.
-    The default limit is 1000 results per page, it is not expected that a query
-    will match more than 1000 results. This is done instead of getting a single
-    user because this doesn't return a 404 code when the user isn't found.
-    
-    Parameters
-    ==========
-    account : `dict`
-        Dictionary with the data that Grafana can receive for account creation with
-        the API. This is the same data which is found on an org's ``accounts.yaml``
-        file. Grafana 5.4.2 supports the following fields:
-        - ``login``: Username of the new user (`str`).
-        - ``password``: Password of the new user (`str`).
-        - ``name``: Name of the new user (`str`).
-        - ``email``: Email of the new user (`str`).
-    user : `str`
-        ``login`` of the Grafana account that is making the API request.
-    password : `str`
-        ``password`` of the Grafana account that is making the API request.
-    
-    Returns
-    =======
-    userId : `int`
-        Grafana ``id`` of the user. Either of an existing account or a new one.
-    
-    Raises
-    ======
-    grafanaAPI.APIError
-        Raised if the request replies with a status code in the 4XX or 5XX range.
-        The causes include: Trying to create an account with an email already in
-        use, invalid password or email, invalid credentials (`user` and
-        `password`), the user doesn't have permission to make this request or the
-        server is not responding. Check the error messages for more information.
-    
-    See Also
-    ========
-    grafanaAPI.request
-    grafanaAPI.createAccount
-    """
-    login = account['login']
-    r = gapi.request('get', 'users/search?query={}'.format(login), user, password)
-    users = r.json()['users']
-    # https://stackoverflow.com/questions/9979970/#comment12752199_9980160
-    userId = next((user['id'] for user in users if user['login'] == login), None)
-    # Check if user exists or else create it
-    if userId is None:
-        userId = gapi.createAccount(account, user, password)
-    return userId
-
-
-def loadProvisionedUsers(accountsDir, user, password):
-    """Load users from YAML config, create them if the don't exist, get their IDs.
+def loadProvisionedAccounts(accountsDir):
+    """Load accounts from YAML config into dict indexed by login.
     
     Parameters
     ==========
     accountsDir : `str`
         Path to the directory where the accounts YAML files (symlinks) are stored.
-    user : `str`
-        ``login`` of the Grafana account that is making the API request.
-    password : `str`
-        ``password`` of the Grafana account that is making the API request.
     
     Returns
     =======
-    existingUsers : `dict`
-        Dictionary containing all the Grafana users in the provisioning 
-        configuration. Consists of one key per user, where the key is the user's
-        username and the value is the user's ID in Grafana.
+    accounts : `dict`
+        Dictionary containing all the accounts in the provisioning configuration.
+        Consists of one key per account, where the key is the account's username
+        and the value is the account's data, as found in ``accounts.yaml``.
     
     Raises
     ======
@@ -148,12 +128,6 @@ def loadProvisionedUsers(accountsDir, user, password):
         the same user, in this case only one of them should provision the user in
         the ``accounts.yaml`` file, but both of them should have the user in their
         ``org.yaml`` file.
-    grafanaAPI.APIError
-        Raised if the request replies with a status code in the 4XX or 5XX range.
-        The causes include: email already in use, invalid password or email,
-        invalid credentials (`user` and `password`), the user doesn't have
-        permission to make this request or the server is not responding. Check the
-        error messages for more information.
     yaml.YAMLError
         Raised if an accounts file does not contain a valid YAML format.
     PermissionError:
@@ -161,10 +135,9 @@ def loadProvisionedUsers(accountsDir, user, password):
     
     See Also
     ========
-    getOrCreateUser
     yamlUtility.getYamlContent
     """
-    existingUsers = {}
+    accounts = {}
     # Don't open the files that start with '_'
     # https://stackoverflow.com/a/36295481
     for accountsFile in glob.glob('{}/[!_]*.yaml'.format(accountsDir)):
@@ -173,191 +146,708 @@ def loadProvisionedUsers(accountsDir, user, password):
         if accountsList is not None:
             for account in accountsList:
                 login = account['login']
-                if login in existingUsers:
+                if login in accounts:
                     raise ValueError('Duplicate user {} in the yaml configuration. {}'.format(login, accountsFile))
-                existingUsers[login] = getOrCreateUser(account, user, password)
-    return existingUsers
+                accounts[login] = account
+    return accounts
 
 
-def reviewOrgUsers(orgId, provOrgUserList, existingUsers, user, password):
-    """Make sure each user for the given org belongs to it with the correct role.
+def getExistingUserIds(logins, user, password):
+    """Get the IDs of the given users that already exist in Grafana.
     
-    For the given org, go through each user in the list and make sure they are in
-    the org and have the correct role. Assumes the users exists.
+    The ids of users that were already provisioned are taken from
+    `grafanaAPI.idCache`. If some users are not cached, all of Grafana's users are
+    loaded at once into a `grafanaAPI.UserIndex`.
     
     Parameters
     ==========
-    orgId : `int`
-        ID of the organization to review users for.
-    provOrgUserList : `list` of `dict` of `str`
-        List of the users for each org. This is equivalent to the structure found
-        in the ``org.yaml`` input files. Each dict has two keys:
-        - login: Username of the account belonging to the org (`str`).
-        - role: Role that the account has in this organization (`str`).
-    existingUsers : `dict`
-        Dictionary containing all the Grafana users in the provisioning 
-        configuration. Consists of one key per user, where the key is the user's
-        username and the value is the user's ID in Grafana.
+    logins : iterable of `str`
+        Usernames of the users whose IDs are being retrieved.
     user : `str`
         ``login`` of the Grafana account that is making the API request.
     password : `str`
         ``password`` of the Grafana account that is making the API request.
     
+    Returns
+    =======
+    existingUsers : `dict`
+        Dictionary with one key per user that exists in Grafana, where the key is
+        the user's username and the value is the user's ID in Grafana. Users that
+        don't exist are not included.
+    
     Raises
     ======
     grafanaAPI.APIError
         Raised if the request replies with a status code in the 4XX or 5XX range.
-        The causes include: invalid `role`, inexistant organization or user, wrong
-        `login` regarding the given `userId`, invalid credentials (`user` and
-        `password`), the user doesn't have permission to make this request or the
-        server is not responding. Check the error messages for more information.
+        The causes include: invalid credentials (`user` and `password`), the user
+        doesn't have permission to make this request or the server is not
+        responding. Check the error messages for more information.
+    """
+    userIndex = None
+    existingUsers = {}
+    for login in logins:
+        userId = gapi.idCache.get('users', login)
+        if userId is None:
+            if userIndex is None:
+                userIndex = gapi.UserIndex(user, password)
+            userId = userIndex.get(login)
+            if userId is None:
+                continue
+            gapi.idCache.set('users', login, userId)
+        existingUsers[login] = userId
+    return existingUsers
+
+
+def createAccounts(accounts, logins, agapi):
+    """Create several accounts at the same time.
+    
+    The creations are sent concurrently by `agapi`, and each account is removed
+    from the default org as soon as it is created, without waiting for the rest
+    of the accounts.
+    
+    Parameters
+    ==========
+    accounts : `dict`
+        Dictionary containing all the accounts in the provisioning configuration,
+        as returned by `loadProvisionedAccounts`.
+    logins : `list` of `str`
+        Usernames of the accounts that have to be created.
+    agapi : `grafanaAsync.AsyncGrafana`
+        Client of the Grafana account that is making the API requests.
+    
+    Returns
+    =======
+    userIds : `dict`
+        Dictionary from the username of each created account to its ``id``.
+    failures : `dict`
+        Dictionary from the username of each account that couldn't be created to
+        the exception raised, usually a `grafanaAPI.APIError`. The causes include:
+        email already in use, invalid password or email, invalid credentials
+        of `agapi`, the user doesn't have permission to make this request or the
+        server is not responding. The failures don't stop the creation of the rest
+        of the accounts.
     
     See Also
     ========
-    grafanaAPI.setUserRoleOrg
+    grafanaAPI.createAccount
+    """
+    results = agapi.runAll([agapi.createAccount(accounts[login]) for login in logins],
+        returnExceptions=True)
+    userIds = {}
+    failures = {}
+    for login, result in zip(logins, results):
+        if isinstance(result, Exception):
+            failures[login] = result
+        else:
+            userIds[login] = result
+    return userIds, failures
+
+
+class Plan:
+    """Ordered list of changes needed for Grafana to match the configuration.
+    
+    The changes are applied in the order of the attributes below, so that users
+    and orgs exist before users are added to orgs.
+    
+    Attributes
+    ----------
+    createUsers : `list` of `str`
+        Usernames of the accounts that have to be created.
+    createOrgs : `list` of `str`
+        Names of the orgs that have to be created.
+    addMembers : `list` of `tuple`
+        ``(orgName, login, role)`` of the users that have to be added to an org.
+    changeRoles : `list` of `tuple`
+        ``(orgName, login, role)`` of the users whose role in an org changed.
+    """
     
-    Notes
-    =====
-    If an account is configured in an ``org.yaml`` file but it is not found in any
-    ``accounts.yaml`` file, a warning message will be printed and the program will
-    continue normally.
+    def __init__(self):
+        self.createUsers = []
+        self.createOrgs = []
+        self.addMembers = []
+        self.changeRoles = []
     
-    If an account is found more than once in an ``org.yaml`` file, only the first
-    time it appears on the file will be considered for provisioning and a warning
-    message will be printed. The program will continue normally.
-    """
-    members = {}
-    for user in provOrgUserList:
-        login = user['login']
-        if login not in existingUsers:
-            print('Warning: Org number {} is trying to invite user "{}" but the user\'s account was not '
-                'found in the configuration files.'.format(orgId, login))
-            continue
-        if login in members:
-            print('Warning: configuration for user "{}" was found more than once on org number {}. Only '
-                'the first instance is valid.'.format(login, orgId))
-            continue
-        userId = existingUsers[login]
-        
-        gapi.setUserRoleOrg(orgId, userId, login, user['role'], admLogin, admPasswd)
+    def __len__(self):
+        return len(self.createUsers) + len(self.createOrgs) + len(self.addMembers) + len(self.changeRoles)
+    
+    def describe(self):
+        """Return one line of text describing each change, in order.
         
-        members[login] = True
+        Returns
+        =======
+        lines : `list` of `str`
+            Description of every change in the plan.
+        """
+        lines = ['Create user "{}"'.format(login) for login in self.createUsers]
+        lines += ['Create org "{}"'.format(orgName) for orgName in self.createOrgs]
+        lines += ['Add user "{}" to org "{}" as {}'.format(login, orgName, role)
+            for orgName, login, role in self.addMembers]
+        lines += ['Change role of user "{}" in org "{}" to {}'.format(login, orgName, role)
+            for orgName, login, role in self.changeRoles]
+        return lines
 
 
-def reviewExistingOrgs(grafOrgs, provOrgs, existingUsers, user, password):
-    """Loop through all existing orgs and make sure their accounts are provisioned.
+def loadGrafanaState(provOrgs, accounts, kioskName, context, agapi, orgIds=None):
+    """Take a snapshot of the users, orgs and memberships that exist in Grafana.
     
-    Loop through all of Grafana's existing orgs and make sure that the ones which
-    belong to the provisioning have their provisioned accounts associated to them,
-    with the correct role. Remove the org from the `provOrgs` dictionary after
-    finishing to be able to create and review the remaining ones later.
+    Only what is relevant for the provisioning configuration is loaded, using bulk
+    requests: the orgs are loaded with one request, the users from the cache or
+    the `grafanaAPI.UserIndex`, and the members of each provisioned org that
+    exists with one request per org, made concurrently by `agapi`.
     
     Parameters
     ==========
-    grafOrgs : `list` of `dict`
-        List returned by Grafana containing all of its existing organizations.
     provOrgs : `dict`
         Dictionary containing all orgs in the provisioning configuration. Consists
         of one key per org, where the key is the org's name and the value is a list
         with the accounts to be provisioned for the organization.
-    existingUsers : `dict`
-        Dictionary containing all the Grafana users in the provisioning 
-        configuration. Consists of one key per user, where the key is the user's
-        username and the value is the user's ID in Grafana.
-    user : `str`
-        ``login`` of the Grafana account that is making the API request.
-    password : `str`
-        ``password`` of the Grafana account that is making the API request.
+    accounts : `dict`
+        Dictionary containing all the accounts in the provisioning configuration,
+        as returned by `loadProvisionedAccounts`.
+    kioskName : `str`
+        Name of the first organization (id=1), which is reviewed by its id.
+    context : `runContext.RunContext`
+        Configuration and credentials of the run, the requests are made with its
+        API account.
+    agapi : `grafanaAsync.AsyncGrafana`
+        Client of the API account, which loads the members of the orgs.
+    orgIds : `dict`, optional
+        The ``id`` of every org in Grafana, as returned by `grafanaAPI.getOrgIds`,
+        if they were already loaded in this run. If not given, they are loaded.
+    
+    Returns
+    =======
+    state : `dict`
+        Snapshot of Grafana's state, with four keys:
+        - userIds: `dict` from username to ``id`` of the existing users.
+        - orgIds: `dict` from name to ``id`` of the existing orgs.
+        - members: `dict` from org name to the members of the org, as returned by
+          `grafanaAPI.getOrgMembers`, for each provisioned org that exists.
+        - errors: `dict` from org name to the exception raised when loading the
+          members of the org, for the orgs that failed.
     
     Raises
     ======
     grafanaAPI.APIError
-        Raised if the request replies with a status code in the 4XX or 5XX range.
-        The causes include: wrong parameters, invalid `role`, inexistant user,
-        invalid credentials (`user` and `password`), the user doesn't have 
-        permission to make this request or the server is not responding. Check the
-        error messages for more information.
+        Raised if loading the users or the orgs replies with a status code in the
+        4XX or 5XX range. The causes include: invalid credentials of the API
+        account, the user doesn't have permission to make this request or the
+        server is not responding. Check the error messages for more information.
     
-    See Also
-    ========
-    reviewOrgUsers
-    grafanaAPI.setUserRoleOrg
+    Notes
+    =====
+    If the ``id`` of a member doesn't match the one of the user, which can come
+    from the cache, it is corrected with the one in the org. Members that are
+    provisioned accounts are always in ``userIds``, so every change of role in
+    `computePlan` has the ``id`` of its user.
     """
-    for org in grafOrgs:
-        orgName = org['name']
-        if orgName in provOrgs:
-            reviewOrgUsers(org['id'], provOrgs[orgName], existingUsers, user, password)
-            del provOrgs[orgName]
+    user, password = context.user, context.password
+    userIds = getExistingUserIds(accounts, user, password)
+    if orgIds is None:
+        orgIds = gapi.getOrgIds(user, password)
+    else:
+        orgIds = dict(orgIds)
+    # The first organization is always reviewed, even if it was renamed
+    orgIds[kioskName] = 1
+    
+    existingOrgs = [orgName for orgName in provOrgs if orgName in orgIds]
+    results = agapi.runAll([agapi.getOrgMembers(orgIds[orgName]) for orgName in existingOrgs],
+        returnExceptions=True)
+    
+    members = {}
+    errors = {}
+    for orgName, result in zip(existingOrgs, results):
+        if isinstance(result, Exception):
+            errors[orgName] = result
+            continue
+        members[orgName] = result
+        for login, (memberId, role) in members[orgName].items():
+            if login in accounts and userIds.get(login) != memberId:
+                userIds[login] = memberId
+                gapi.idCache.set('users', login, memberId)
+    return {'userIds': userIds, 'orgIds': orgIds, 'members': members, 'errors': errors}
 
 
-def createAndReviewOrgs(provOrgs, existingUsers, user, password):
-    """Loop through non existing orgs, create them and provision their accounts.
+def computePlan(provOrgs, accounts, state, mainAdmin):
+    """Compare the configuration with Grafana's state and plan the changes.
     
     Parameters
     ==========
     provOrgs : `dict`
-        Dictionary containing all orgs in the provisioning configuration that have
-        not been created yet. Consists of one key per org, where the key is the
-        org's name and the value is a list with the accounts to be provisioned for
-        the organization.
-    existingUsers : `dict`
-        Dictionary containing all the Grafana users in the provisioning 
-        configuration. Consists of one key per user, where the key is the user's
-        username and the value is the user's ID in Grafana.
-    user : `str`
-        ``login`` of the Grafana account that is making the API request.
-    password : `str`
-        ``password`` of the Grafana account that is making the API request.
+        Dictionary containing all orgs in the provisioning configuration. Consists
+        of one key per org, where the key is the org's name and the value is a list
+        with the accounts to be provisioned for the organization.
+    accounts : `dict`
+        Dictionary containing all the accounts in the provisioning configuration,
+        as returned by `loadProvisionedAccounts`.
+    state : `dict`
+        Snapshot of Grafana's state, as returned by `loadGrafanaState`.
+    mainAdmin : `str`
+        Username of Grafana's main admin, who is added as Admin to every org when
+        it's created.
+    
+    Returns
+    =======
+    plan : `Plan`
+        The changes needed for Grafana to match the configuration.
+    
+    Notes
+    =====
+    If an account is configured in an ``org.yaml`` file but it is not found in any
+    ``accounts.yaml`` file, a warning message will be printed and the account will
+    be ignored for that org.
+    
+    If an account is found more than once in an ``org.yaml`` file, only the first
+    time it appears on the file will be considered for provisioning and a warning
+    message will be printed.
+    
+    Orgs whose members couldn't be loaded are left out of the plan.
+    """
+    plan = Plan()
+    plan.createUsers = [login for login in accounts if login not in state['userIds']]
+    
+    for orgName, provOrgUserList in provOrgs.items():
+        if orgName in state['errors']:
+            continue
+        if orgName in state['orgIds']:
+            currentMembers = state['members'][orgName]
+        else:
+            plan.createOrgs.append(orgName)
+            # Grafana's main admin is added when creating the org
+            currentMembers = {mainAdmin: (None, 'Admin')}
+        
+        members = {}
+        for orgUser in provOrgUserList or []:
+            login = orgUser['login']
+            if login not in accounts:
+                print('Warning: Org "{}" is trying to invite user "{}" but the user\'s account was not '
+                    'found in the configuration files.'.format(orgName, login))
+                continue
+            if login in members:
+                print('Warning: configuration for user "{}" was found more than once on org "{}". Only '
+                    'the first instance is valid.'.format(login, orgName))
+                continue
+            role = orgUser['role'].capitalize()
+            members[login] = role
+            
+            if login not in currentMembers:
+                plan.addMembers.append((orgName, login, role))
+            elif currentMembers[login][1] != role:
+                plan.changeRoles.append((orgName, login, role))
+    return plan
+
+
+async def applyOrgChanges(orgName, create, addMembers, changeRoles, state, context, agapi):
+    """Coroutine that creates an org if needed, and adds its members or changes their roles.
+    
+    Parameters
+    ==========
+    orgName : `str`
+        Name of the org whose changes are applied.
+    create : `bool`
+        True if the org has to be created first.
+    addMembers : `list` of `tuple`
+        ``(login, role)`` of the users that have to be added to the org.
+    changeRoles : `list` of `tuple`
+        ``(login, role)`` of the users whose role in the org has to be changed.
+    state : `dict`
+        Snapshot of Grafana's state, as returned by `loadGrafanaState`. It is
+        updated with the ``id`` of the org if it's created.
+    context : `runContext.RunContext`
+        Configuration and credentials of the run. Its main admin is added as
+        Admin to every new org, and the requests are made with its API account.
+    agapi : `grafanaAsync.AsyncGrafana`
+        Client of the API account of `context`.
     
     Raises
     ======
     grafanaAPI.APIError
         Raised if the request replies with a status code in the 4XX or 5XX range.
-        The causes include: wrong parameters, invalid `role`, inexistant user,
-        invalid credentials (`user` and `password`), the user doesn't have 
-        permission to make this request or the server is not responding. Check the
-        error messages for more information.
+        The causes include: invalid role, inexistant user, invalid credentials of
+        the API account, the user doesn't have permission to make this request or
+        the server is not responding. Check the error messages for more
+        information.
     
     See Also
     ========
-    reviewExistingOrgs
-    reviewOrgUsers
     grafanaAPI.createOrg
+    grafanaAPI.addOrgUser
+    grafanaAPI.updateOrgUserRole
+    """
+    userIds = state['userIds']
+    if create:
+        state['orgIds'][orgName] = await agapi.createOrg(orgName, context.mainAdmin, context.apiUserId)
+    orgId = state['orgIds'][orgName]
+    
+    for login, role in addMembers:
+        await agapi.addOrgUser(orgId, userIds[login], login, role)
+    
+    for login, role in changeRoles:
+        await agapi.updateOrgUserRole(orgId, userIds[login], role)
+
+
+def applyPlan(plan, accounts, state, context, agapi):
+    """Make the changes of a plan in Grafana.
+    
+    The accounts are created first, concurrently. Then the changes of every org
+    are applied concurrently, since they are independent from each other. The
+    changes of a single org are applied in order. If an account can't be created,
+    only the memberships of that account are skipped.
+    
+    Parameters
+    ==========
+    plan : `Plan`
+        The changes to be made, as returned by `computePlan`.
+    accounts : `dict`
+        Dictionary containing all the accounts in the provisioning configuration,
+        as returned by `loadProvisionedAccounts`.
+    state : `dict`
+        Snapshot of Grafana's state, as returned by `loadGrafanaState`. It is
+        updated with the users and orgs that are created.
+    context : `runContext.RunContext`
+        Configuration and credentials of the run, the requests are made with its
+        API account.
+    agapi : `grafanaAsync.AsyncGrafana`
+        Client of the API account of `context`, which makes the requests.
+    
+    Returns
+    =======
+    errors : `dict`
+        Dictionary from org name to the exception raised while applying the
+        changes of the org, for each org that failed. The rest of the orgs are
+        not affected by the failed ones.
+    accountErrors : `dict`
+        Dictionary from username to the exception raised while creating the
+        account, for each account that couldn't be created. See
+        `createAccounts`.
+    
+    See Also
+    ========
+    applyOrgChanges
+    createAccounts
+    """
+    userIds, accountErrors = createAccounts(accounts, plan.createUsers, agapi)
+    state['userIds'].update(userIds)
+    
+    # Group the changes by org, keeping their order
+    orgChanges = {orgName: (True, [], []) for orgName in plan.createOrgs}
+    for orgName, login, role in plan.addMembers:
+        if login in accountErrors:
+            continue
+        orgChanges.setdefault(orgName, (False, [], []))[1].append((login, role))
+    for orgName, login, role in plan.changeRoles:
+        orgChanges.setdefault(orgName, (False, [], []))[2].append((login, role))
+    
+    results = agapi.runAll([applyOrgChanges(orgName, create, addMembers, changeRoles, state, context, agapi)
+        for orgName, (create, addMembers, changeRoles) in orgChanges.items()], returnExceptions=True)
+    errors = {orgName: result for orgName, result in zip(orgChanges, results) if isinstance(result, Exception)}
+    return errors, accountErrors
+
+
+class Fingerprints:
+    """Digests of the configuration of each org from the last successful run.
+    
+    Each org is stored with the digest of its configuration and its ``id`` in
+    Grafana. The digest of all the accounts and the time of the last full review
+    are also stored. The fingerprints are loaded from a JSON file, and only
+    written back to it with `save` when they changed.
+    
+    Parameters
+    ----------
+    path : `str`, optional
+        Path of the JSON file where the fingerprints are stored. If None, they are
+        only kept in memory.
     
     Notes
     =====
-    Relies on deleting the existing orgs from provOrgs
+    If the file is missing or can't be read every org is reviewed, as in a full
+    run.
     """
-    # This shouldn't do anything unless an org is manually deleted from
-    # Grafana, because orgs are created when processing new input
-    gadmin = yutil.getSuperAdminLogin()
-    for orgName in provOrgs:
-        orgId = gapi.createOrg(orgName, gadmin, user, password)
-        reviewOrgUsers(orgId, provOrgs[orgName], existingUsers, user, password)
     
+    def __init__(self, path=None):
+        self.path = path
+        self.data = {'orgs': {}, 'accounts': None, 'lastFull': 0}
+        self.modified = False
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as fingerprintsFile:
+                    self.data.update(json.load(fingerprintsFile))
+            except (ValueError, OSError):
+                print('Warning: The fingerprints at {} could not be read, all orgs will be '
+                    'reviewed.'.format(path))
+    
+    def fullCheckDue(self, interval):
+        """Return True if the last full review is older than `interval` seconds.
+        
+        Parameters
+        ==========
+        interval : `float`
+            Seconds between full reviews. If 0, every run is a full review.
+        
+        Returns
+        =======
+        due : `bool`
+            True if all the orgs have to be reviewed.
+        """
+        return time.time() - self.data['lastFull'] >= interval
+    
+    def orgChanged(self, orgName, digest):
+        """Return True if an org has to be reviewed because its configuration changed.
+        
+        Parameters
+        ==========
+        orgName : `str`
+            Name of the org.
+        digest : `str`
+            Digest of the current configuration of the org, see `orgDigest`.
+        
+        Returns
+        =======
+        changed : `bool`
+            True if the org wasn't stored with the same digest.
+        """
+        stored = self.data['orgs'].get(orgName)
+        return stored is None or stored['digest'] != digest
+    
+    def orgRecreated(self, orgName, orgId):
+        """Return True if an org has to be reviewed because it changed in Grafana.
+        
+        Parameters
+        ==========
+        orgName : `str`
+            Name of the org.
+        orgId : `int` or `None`
+            Current ``id`` of the org in Grafana, or None if it doesn't exist.
+        
+        Returns
+        =======
+        recreated : `bool`
+            True if the org was deleted, or recreated with a different ``id``
+            than the stored one.
+        """
+        stored = self.data['orgs'].get(orgName)
+        return orgId is None or stored is None or stored['orgId'] != orgId
+    
+    def accountsChanged(self, digest):
+        """Return True if the accounts changed since they were stored."""
+        return self.data['accounts'] != digest
+    
+    def setOrg(self, orgName, digest, orgId):
+        """Store the digest of an org that was reviewed successfully."""
+        self.data['orgs'][orgName] = {'digest': digest, 'orgId': orgId}
+        self.modified = True
+    
+    def evictOrg(self, orgName):
+        """Remove an org, so that it is reviewed on the next run."""
+        if self.data['orgs'].pop(orgName, None) is not None:
+            self.modified = True
+    
+    def setAccounts(self, digest, full=False):
+        """Store the digest of the accounts, and the time if it was a full review."""
+        self.data['accounts'] = digest
+        if full:
+            self.data['lastFull'] = time.time()
+        self.modified = True
+    
+    def save(self, orgNames=None):
+        """Write the fingerprints to their file if they have been modified.
+        
+        Parameters
+        ==========
+        orgNames : iterable of `str`, optional
+            Names of the orgs in the configuration. If given, the fingerprints of
+            the orgs that were removed from it are dropped.
+        
+        Raises
+        ======
+        PermissionError:
+            Raised if the script does not have write permissions on the file or its
+            directory.
+        """
+        if orgNames is not None:
+            removed = self.data['orgs'].keys() - set(orgNames)
+            for orgName in removed:
+                del self.data['orgs'][orgName]
+            self.modified = self.modified or bool(removed)
+        if self.path is None or not self.modified:
+            return
+        futil.writeIfChanged(self.path, json.dumps(self.data, indent=2, sort_keys=True).encode('utf-8'))
+        self.modified = False
 
-if __name__ == '__main__':
-    gapi.timeout = yutil.config['timeout']
-    provisioningDir = yutil.config['provisioningDir']
-    adminsDir = '{}/admins'.format(provisioningDir)
-    accountsDir = '{}/accounts'.format(provisioningDir)
-    orgsDir = '{}/orgs'.format(provisioningDir)
+
+def _digest(content):
+    """Return the sha256 hex digest of content that can be serialized as JSON."""
+    serialized = json.dumps(content, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def orgDigest(orgUserList, accounts):
+    """Digest of the resolved configuration of an org.
     
-    # Get API user and password
-    api = yutil.getYamlContent('{}/_superAdmins.yaml'.format(adminsDir))['api']
-    admLogin = api['login']
-    admPasswd = api['password']
+    Parameters
+    ==========
+    orgUserList : `list`
+        Accounts to be provisioned for the organization, as in `provOrgs`.
+    accounts : `dict`
+        Dictionary containing all the accounts in the provisioning configuration,
+        as returned by `loadProvisionedAccounts`.
     
-    provOrgs = loadProvisionedOrgs(orgsDir)
-    existingUsers = loadProvisionedUsers(accountsDir, admLogin, admPasswd)
+    Returns
+    =======
+    digest : `str`
+        sha256 hex digest of the members of the org and their accounts, so it
+        changes if either the ``org.yaml`` or the ``accounts.yaml`` of a member
+        changes.
+    """
+    orgUserList = orgUserList or []
+    members = [accounts.get(orgUser.get('login')) for orgUser in orgUserList]
+    return _digest([orgUserList, members])
+
+
+def printSummary(provOrgs, errors, accountErrors=None):
+    """Print how many orgs were reconciled and the error of each failed org and account.
     
-    # Get all the orgs in Grafana
-    r = gapi.request('get', 'orgs', admLogin, admPasswd)
-    grafOrgs = r.json()
+    Parameters
+    ==========
+    provOrgs : `dict`
+        Dictionary containing all orgs in the provisioning configuration.
+    errors : `dict`
+        Dictionary from org name to the exception raised for each failed org.
+    accountErrors : `dict`, optional
+        Dictionary from username to the exception raised for each account that
+        couldn't be created.
+    """
+    accountErrors = accountErrors or {}
+    print('Reconciled {} orgs, {} failed.'.format(len(provOrgs) - len(errors), len(errors)))
+    for orgName, exc in sorted(errors.items()):
+        print('Error: Org "{}" failed with {}: {}'.format(orgName, type(exc).__name__, exc))
+    if accountErrors:
+        print('{} accounts could not be created.'.format(len(accountErrors)))
+    for login, exc in sorted(accountErrors.items()):
+        print('Error: Account "{}" failed with {}: {}'.format(login, type(exc).__name__, exc))
+
+
+def provisionAccounts(context, dryRun=False, full=False, orgIds=None, orgFiles=None):
+    """Review the orgs and accounts of the configuration and apply the changes.
+    
+    This is the main body of the script, which can also be run by other scripts
+    in the same process, see ``gpProvision.py``.
+    
+    Parameters
+    ==========
+    context : `runContext.RunContext`
+        Configuration and credentials of the run.
+    dryRun : `bool`, optional
+        If True, the changes are only printed, and neither Grafana nor the
+        fingerprints and ids cache files are modified. Defaults to False.
+    full : `bool`, optional
+        If True, every org is reviewed, even if its configuration didn't change.
+        Defaults to False.
+    orgIds : `dict`, optional
+        The ``id`` of every org in Grafana, if they were already loaded in this
+        run. See `loadGrafanaState`.
+    orgFiles : `dict`, optional
+        Contents of the ``org.yaml`` files that were already parsed in this run.
+        See `loadProvisionedOrgs`.
+    
+    Returns
+    =======
+    errors : `dict`
+        Dictionary from org name to the exception raised for each failed org.
+    accountErrors : `dict`
+        Dictionary from username to the exception raised for each account that
+        couldn't be created.
     
-    reviewExistingOrgs(grafOrgs, provOrgs, existingUsers, admLogin, admPasswd)
-    createAndReviewOrgs(provOrgs, existingUsers, admLogin, admPasswd)
+    Raises
+    ======
+    ValueError
+        Raised if an org or an account is duplicated in the configuration.
+    grafanaAPI.APIError
+        Raised if loading the users or orgs replies with a status code in the 4XX
+        or 5XX range.
+    """
+    provisioningDir = context.provisioningDir
+    accountsDir = '{}/accounts'.format(provisioningDir)
+    orgsDir = '{}/orgs'.format(provisioningDir)
     
+    # Desired state, from the configuration files
+    provOrgs = loadProvisionedOrgs(orgsDir, orgFiles)
+    accounts = loadProvisionedAccounts(accountsDir)
     # Review users for the first organization (Kiosk)
-    kiosk = yutil.getYamlContent('{}/_kiosk.yaml'.format(adminsDir))
-    reviewOrgUsers(1, kiosk['Kiosk'], existingUsers, admLogin, admPasswd)
+    kiosk = yutil.getYamlContent('{}/_kiosk.yaml'.format(context.adminsDir))
+    kioskName = next(iter(kiosk))
+    provOrgs.setdefault(kioskName, kiosk[kioskName])
+    
+    # Only review the orgs whose configuration changed since the last run
+    fingerprints = Fingerprints('{}/.accountsFingerprints.json'.format(provisioningDir))
+    full = full or fingerprints.fullCheckDue(context.config.get('fullCheckSeconds', 86400))
+    digests = {orgName: orgDigest(orgUserList, accounts) for orgName, orgUserList in provOrgs.items()}
+    accountsDigest = _digest(accounts)
+    if full:
+        reviewOrgs = provOrgs
+    else:
+        reviewOrgs = {orgName: orgUserList for orgName, orgUserList in provOrgs.items()
+            if fingerprints.orgChanged(orgName, digests[orgName])}
+        # Orgs that were deleted or recreated in Grafana have to be reviewed again,
+        # which costs one request if their ids were not loaded in this run yet
+        if orgIds is None:
+            orgIds = gapi.getOrgIds(context.user, context.password)
+        currentIds = dict(orgIds)
+        currentIds[kioskName] = 1
+        reviewOrgs.update({orgName: orgUserList for orgName, orgUserList in provOrgs.items()
+            if orgName not in reviewOrgs and fingerprints.orgRecreated(orgName, currentIds.get(orgName))})
+        if not reviewOrgs and not fingerprints.accountsChanged(accountsDigest):
+            print('The configuration and the orgs in Grafana did not change since the last run, '
+                'nothing to review.')
+            if not dryRun:
+                fingerprints.save(provOrgs)
+            return {}, {}
+    
+    # Actual state, from Grafana, and the changes are requested concurrently by one client
+    agapi = AsyncGrafana(context.user, context.password, context.config.get('orgWorkers', 4))
+    try:
+        state = loadGrafanaState(reviewOrgs, accounts, kioskName, context, agapi, orgIds)
+        plan = computePlan(reviewOrgs, accounts, state, context.mainAdmin)
+        accountErrors = {}
+        if not dryRun:
+            orgErrors, accountErrors = applyPlan(plan, accounts, state, context, agapi)
+    finally:
+        agapi.close()
+    
+    errors = dict(state['errors'])
+    if dryRun:
+        print('{} changes to be made:'.format(len(plan)))
+        for line in plan.describe():
+            print('    {}'.format(line))
+    else:
+        errors.update(orgErrors)
+        # Orgs with members that couldn't be added are reviewed again on the next run
+        incomplete = {orgName for orgName, login, role in plan.addMembers if login in accountErrors}
+        for orgName in reviewOrgs:
+            if orgName in errors or orgName in incomplete:
+                fingerprints.evictOrg(orgName)
+            else:
+                fingerprints.setOrg(orgName, digests[orgName], state['orgIds'][orgName])
+        if not accountErrors:
+            fingerprints.setAccounts(accountsDigest, full)
+        fingerprints.save(provOrgs)
+        gapi.idCache.save()
+    
+    printSummary(reviewOrgs, errors, accountErrors)
+    return errors, accountErrors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Provision organizations and accounts in Grafana.')
+    parser.add_argument('--dry-run', action='store_true',
+        help='Print the changes that would be made to Grafana without making them.')
+    parser.add_argument('--full', action='store_true',
+        help='Review every org, even if its configuration did not change since the last run.')
+    args = parser.parse_args()
+    
+    context = RunContext()
+    # Write the statistics of the API requests when the script ends, even if it fails
+    atexit.register(gapi.dumpMetrics, '{}/gpAccountsMetrics.json'.format(context.config['metricsDir']))
+    errors, accountErrors = provisionAccounts(context, args.dry_run, args.full)
+    if errors or accountErrors:
+        sys.exit(1)
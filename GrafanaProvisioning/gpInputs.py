@@ -25,8 +25,9 @@ The script will create a symlink to this file in the ``accounts/`` directory.
 Datasources
 -----------
 The script will create the final version of this file inside
-`/etc/grafana/provisioning/datasources` which **will be read by grafana-server
-when it starts**.
+`/etc/grafana/provisioning/datasources` (or the configured
+`grafanaProvisioningDir`) which **will be read by grafana-server when it
+starts**.
 
 Dashboards
 ----------
@@ -39,6 +40,35 @@ folder structure **will be read by grafana-server when it starts**, the
 dashboards inside them will be checked for changes inside the provided folders
 with a time period configured by `updateIntervalSeconds`.
 
+A dashboard is only copied again when the content of its JSON file changes, or
+when the copy was modified. The hash of every input dashboard and of its copy
+are stored in the ``.manifest.json`` file of the org's directory in
+`dashboardsDir`, together with the size and modification time of both files, so
+that files whose size and modification time didn't change are not hashed again.
+The dashboards that need to be copied are transformed by a pool of
+``dashboardWorkers`` processes, in chunks of ``dashboardChunkSize`` files.
+
+Every transformed dashboard is written once to the `DashboardStore` in the
+hidden ``.objects`` directory of `dashboardsDir`, named by the hash of its
+content, and the dashboards of every org and folder are hard links to it, so
+orgs that provision the same dashboard share a single file. The dashboards that
+are no longer linked from any org are removed from the store at the end of the
+run.
+
+Every file that Grafana reads is written with `fileUtility.writeIfChanged`: it
+is replaced atomically, so Grafana never reads a partially written file, and it
+isn't written at all if its content is the same.
+
+Watch mode
+----------
+With ``--watch`` the script keeps running after provisioning every input, and
+provisions each input again as soon as it changes (see `watchInputs`), instead
+of waiting for the next Puppet execution. Only the org that changed is
+provisioned, or only its folders if just their dashboards changed. The
+``inputs`` directory is watched with inotify, or scanned every
+``watchPollSeconds`` where inotify is not available, and a burst of changes is
+provisioned once nothing changed for ``watchDebounceSeconds``.
+
 Notes
 =====
 Provisioning configurations are stored in ``config.yaml``.
@@ -47,13 +77,25 @@ Functions
 =========
 """
 import os
+import sys
+import atexit
+import signal
+import argparse
 import copy
-import glob
 import json
 import shutil
+import errno
+import fcntl
+import hashlib
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import grafanaAPI as gapi
 import yamlUtility as yutil
+import jsonUtility as jutil
+import fileUtility as futil
+import inputWatcher as iwatch
+from runContext import RunContext
 
 
 def getDirList(top):
@@ -77,26 +119,30 @@ def getDirList(top):
     return [d for d in next(os.walk(top))[1] if not d.startswith('.')]
 
 
-def provisionOrg(orgInputDir, user, password, provisionedOrgs):
+def provisionOrg(orgInputDir, context, provisionedOrgs, orgIds):
     """Makes sure that the organization in Grafana is provisioned.
     
-    If the organization already exists, get the org's id from Grafana. Else, create
-    the org in Grafana and the symlink to ``org.yaml`` inside ``orgs/``. Returns
-    the org's id and name.
+    If the organization already exists, get the org's id from `orgIds`, which
+    holds every org in Grafana. Else, create the org in Grafana and the symlink to
+    ``org.yaml`` inside ``orgs/``, and add the new org to `orgIds`. Returns the
+    org's id and name.
     
     Parameters
     ==========
     orgInputDir : `str`
         The directory where the inputs for this org are stored.
-    user : `str`
-        ``login`` of the Grafana account that is making the API request.
-    password : `str`
-        ``password`` of the Grafana account that is making the API request.
+    context : `runContext.RunContext`
+        Configuration and credentials of the run.
     provisionedOrgs : `dict`
         Dictionary containing all orgs in the provisioning configuration. Consists
-        of one key per org, where the key is the org's name and the value True for
-        all provisioned organizations. We use a dictionary instead of a list
-        because it should be faster for searching if an org is provisioned.
+        of one key per org, where the key is the org's name and the value is the
+        list with the accounts of the org in ``org.yaml``. We use a dictionary
+        instead of a list because it should be faster for searching if an org is
+        provisioned.
+    orgIds : `dict`
+        Dictionary containing all orgs in Grafana, as returned by
+        `grafanaAPI.getOrgIds`. Consists of one key per org, where the key is the
+        org's name and the value is its id.
     
     Returns
     =======
@@ -116,12 +162,13 @@ def provisionOrg(orgInputDir, user, password, provisionedOrgs):
         Raised if the request replies with a status code in the 4XX or 5XX range.
         The causes include: the symlink in ``orgs/`` exists but the organization in
         Grafana doesn't (in this case delete the symlink manually), the org already
-        exists in Grafana and the symlink doesn't, invalid credentials (`user` and
-        `password`), the user doesn't have permission to make this request or the
+        exists in Grafana and the symlink doesn't, invalid credentials of the API
+        account, the user doesn't have permission to make this request or the
         server is not responding. Check the error messages for more information.
     
     See Also
     ========
+    grafanaAPI.getOrgIds
     grafanaAPI.getOrgId
     grafanaAPI.createOrg
     
@@ -144,20 +191,27 @@ def provisionOrg(orgInputDir, user, password, provisionedOrgs):
     if orgName in provisionedOrgs:
         raise ValueError('Duplicate organization {} in the yaml configuration. {}/org.yaml'
             .format(orgName, orgInputDir))
-    provisionedOrgs[orgName] = True
+    provisionedOrgs[orgName] = orgDict[orgName]
     
     # Check if org is provisioned (file or symlink exists in ./orgs)
-    symlink = '{}/orgs/{}_org.yaml'.format(provisioningDir, orgName)
+    symlink = '{}/orgs/{}_org.yaml'.format(context.provisioningDir, orgName)
     if os.path.exists(symlink):
         # Get org's id
-        orgId = gapi.getOrgId(orgName, user, password)
+        if orgName in orgIds:
+            orgId = orgIds[orgName]
+        else:
+            # The org is not in Grafana, the cache can't have it either. This
+            # fails with the same error as when the org was looked up by name.
+            gapi.idCache.evict('orgs', orgName)
+            orgId = gapi.getOrgId(orgName, context.user, context.password)
     else:
         # Add the symlink to org
         os.symlink(file, symlink)
         # Create org and get the id
-        gadmin = yutil.getSuperAdminLogin()
         try:
-            orgId = gapi.createOrg(orgName, gadmin, user, password)
+            orgId = gapi.createOrg(orgName, context.mainAdmin, context.user, context.password,
+                context.apiUserId)
+            orgIds[orgName] = orgId
         except Exception as exc:
             os.remove(symlink)
             print('The operation failed while creating or configuring the  organization "{}". If the org was '
@@ -168,7 +222,7 @@ def provisionOrg(orgInputDir, user, password, provisionedOrgs):
     return orgId, orgName
 
 
-def provisionDatasources(orgId, orgName, dSrcYaml):
+def provisionDatasources(orgId, orgName, dSrcYaml, config):
     """Create datasources config, which is read by grafana-server when it starts.
     
     Loads the configuration provided in ``org.yaml``, adds the corresponding
@@ -188,6 +242,13 @@ def provisionDatasources(orgId, orgName, dSrcYaml):
         - apiVersion: Version of the input ``datasources.yaml`` file (`int`).
         - datasources: List of datasources, with all the necessary configurations
             except for `orgId` and ``editable``, which are added here.
+    config : `dict`
+        The contents of ``config.yaml``, see `runContext.RunContext`.
+    
+    Returns
+    =======
+    written : `bool`
+        True if the datasources file was written, False if it didn't change.
     
     Raises
     ======
@@ -210,19 +271,38 @@ def provisionDatasources(orgId, orgName, dSrcYaml):
         dSrc['editable'] = False
     
     # Provision datasources to Grafana's installation folder
-    yutil.writeYamlContent('/etc/grafana/provisioning/datasources/{}_datasources.yaml'
-        .format(orgName), dSrcYaml)
+    return yutil.writeYamlContent('{}/datasources/{}_datasources.yaml'
+        .format(config['grafanaProvisioningDir'], orgName), dSrcYaml)
 
 
-def copyDashboardWithoutIds(source, dest):
+def copyDashboardWithoutIds(source, dest, compact=False):
     """Load source JSON file, delete ID and UID, and save the dashboard at dest.
     
+    ``id`` and ``uid`` are removed from the bytes of the dashboard with
+    `jsonUtility.stripMembers`, which validates it and keeps the rest of the file
+    unchanged without building it as Python objects. If the output is `compact`,
+    or the dashboard is rejected by `jsonUtility.stripMembers`, it's parsed with
+    `jsonUtility`, which uses the fastest JSON library that is installed, and
+    written again without them instead. `dest` is replaced atomically with
+    `fileUtility.writeIfChanged`, and it's left untouched if it already has the
+    same content.
+    
     Parameters
     ==========
     source : `str`
         Path to input JSON file containing a dashboard.
     dest : `str`
         Path to output JSON file, the dashboard to be provisioned at dashboardsDir.
+    compact : `bool`, optional
+        If True, the dashboard is written without indentation, which is smaller
+        and faster for Grafana to read. Defaults to False.
+    
+    Returns
+    =======
+    sourceHash : `str`
+        sha256 hex digest of the content of `source`.
+    outputHash : `str`
+        sha256 hex digest of the content written to `dest`.
     
     Raises
     ======
@@ -231,48 +311,446 @@ def copyDashboardWithoutIds(source, dest):
     PermissionError:
         Raised if the script does not have permission to read from `source` or to
         write to `dest`.
-    JSONDecodeError:
+    ValueError:
+        Raised if `source` does not contain a valid JSON format. With the standard
+        library it is a `json.JSONDecodeError`.
+    """
+    raw, content = transformDashboard(source, compact)
+    futil.writeIfChanged(dest, content)
+    return hashlib.sha256(raw).hexdigest(), hashlib.sha256(content).hexdigest()
+
+
+def storeDashboardWithoutIds(source, store, compact=False):
+    """Load source JSON file, delete ID and UID, and add the dashboard to store.
+    
+    The dashboard is transformed like in `copyDashboardWithoutIds`, but it is
+    written to `store` instead of to its provisioned path, which is linked to it
+    afterwards with `DashboardStore.link`.
+    
+    Parameters
+    ==========
+    source : `str`
+        Path to input JSON file containing a dashboard.
+    store : `DashboardStore`
+        Store where the transformed dashboard is written.
+    compact : `bool`, optional
+        If True, the dashboard is written without indentation. Defaults to False.
+    
+    Returns
+    =======
+    sourceHash : `str`
+        sha256 hex digest of the content of `source`.
+    outputHash : `str`
+        sha256 hex digest of the transformed dashboard, which is its name in
+        `store`.
+    
+    Raises
+    ======
+    FileNotFoundError:
+        Raised if `source` does not exist or it cannot be accessed by the script.
+    PermissionError:
+        Raised if the script does not have permission to read from `source` or to
+        write to `store`.
+    ValueError:
         Raised if `source` does not contain a valid JSON format.
     """
+    raw, content = transformDashboard(source, compact)
+    return hashlib.sha256(raw).hexdigest(), store.add(content)
+
+
+def transformDashboard(source, compact=False):
+    """Return the content of a dashboard and the content without ID and UID.
+    
+    See `copyDashboardWithoutIds`.
+    
+    Parameters
+    ==========
+    source : `str`
+        Path to input JSON file containing a dashboard.
+    compact : `bool`, optional
+        If True, the dashboard is returned without indentation. Defaults to False.
+    
+    Returns
+    =======
+    raw : `bytes`
+        Content of `source`.
+    content : `bytes`
+        Content of the dashboard without its ``id`` and ``uid``.
+    
+    Raises
+    ======
+    ValueError:
+        Raised if `source` does not contain a valid JSON format.
+    """
+    with open(source, 'rb') as dashboard:
+        raw = dashboard.read()
+    if not compact:
+        try:
+            return raw, jutil.stripMembers(raw, ('id', 'uid'))
+        except ValueError:
+            # It can still be accepted by the JSON library, or else fail below
+            pass
     try:
-        with open(source, 'r', encoding='utf-8') as dashboard:
-            data = json.load(dashboard)
-    except json.JSONDecodeError as exc:
+        data = jutil.loads(raw)
+    except jutil.DecodeError as exc:
         print('The dashboard at {} does not contain a valid JSON format.'.format(source))
         raise exc from None
     data.pop('id', None)
     data.pop('uid', None)
-    with open(dest, 'w', encoding='utf-8') as dashboard:
-        json.dump(data, dashboard, indent=2)
+    return raw, jutil.dumps(data, compact)
 
 
-def needsProvisioning(inputFile, currentFile):
-    """Check if source is newer than dest.
+def fileHash(path):
+    """Return the sha256 hex digest of the content of a file.
     
     Parameters
     ==========
-    inputFile : `str`
-        File in the input folder.
-    currentFile : `str`
-        File created by this script for provisioning Grafana.
+    path : `str`
+        Path of the file.
     
     Returns
     =======
-    inputIsNewer : `bool`
-        True if input file is newer than current provisioning file, else False.
+    digest : `str`
+        sha256 hex digest of the file.
     """
-    # time since last modification of file (float)
-    inputModified = datetime.utcfromtimestamp(os.path.getmtime(inputFile))
-    currentModified = datetime.utcfromtimestamp(os.path.getmtime(currentFile))
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DashboardManifest:
+    """Hashes of the dashboards of an org, from the last time they were copied.
+    
+    Each dashboard is stored by its path relative to the org's dashboards
+    (``folder/name.json``) with the hash, size and modification time of both the
+    input file and its copy, and whether the copy was written compact. The manifest is loaded from a JSON file, and only
+    written back to it with `save` when it changed.
+    
+    Parameters
+    ----------
+    path : `str`
+        Path of the JSON file where the manifest is stored.
     
-    return inputModified > currentModified
+    Notes
+    =====
+    If the file is missing or can't be read, every dashboard is hashed again and
+    the ones whose copy has a different content are copied.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.modified = False
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as manifestFile:
+                    self.entries = json.load(manifestFile)
+            except (ValueError, OSError):
+                print('Warning: The dashboards manifest at {} could not be read, it will be created '
+                    'again.'.format(path))
+    
+    @staticmethod
+    def _hash(path, stat, stored):
+        """Return the hash of a file, reusing the stored one if its stat didn't change."""
+        if stored is not None and stored[1] == stat.st_size and stored[2] == stat.st_mtime_ns:
+            return stored[0]
+        return fileHash(path)
+    
+    def needsProvisioning(self, key, source, sourceStat, dest, destStat, compact=False):
+        """Check if a dashboard has to be copied.
+        
+        Parameters
+        ==========
+        key : `str`
+            Path of the dashboard relative to the org's dashboards.
+        source : `str`
+            Path of the input dashboard.
+        sourceStat : `os.stat_result`
+            Stat of the input dashboard.
+        dest : `str`
+            Path of the copy of the dashboard.
+        destStat : `os.stat_result` or `None`
+            Stat of the copy of the dashboard, or None if it doesn't exist.
+        compact : `bool`, optional
+            If True, the copy has to be written compact. Defaults to False.
+        
+        Returns
+        =======
+        needed : `bool`
+            True if the dashboard was never copied, its content changed since it
+            was copied, the copy was modified or it was written with a different
+            ``compactDashboards``, else False.
+        """
+        entry = self.entries.get(key)
+        if entry is None or destStat is None or entry.get('compact', False) != compact:
+            return True
+        sourceHash = self._hash(source, sourceStat, entry['source'])
+        if sourceHash != entry['source'][0]:
+            return True
+        outputHash = self._hash(dest, destStat, entry['output'])
+        if outputHash != entry['output'][0]:
+            return True
+        # Refresh the stats, so the files are not hashed again on the next run
+        self.set(key, sourceStat, sourceHash, destStat, outputHash, compact)
+        return False
+    
+    def set(self, key, sourceStat, sourceHash, destStat, outputHash, compact=False):
+        """Store the hashes of a dashboard and the stat of its files.
+        
+        Parameters
+        ==========
+        key : `str`
+            Path of the dashboard relative to the org's dashboards.
+        sourceStat : `os.stat_result`
+            Stat of the input dashboard.
+        sourceHash : `str`
+            sha256 hex digest of the input dashboard.
+        destStat : `os.stat_result`
+            Stat of the copy of the dashboard.
+        outputHash : `str`
+            sha256 hex digest of the copy of the dashboard.
+        compact : `bool`, optional
+            True if the copy was written compact. Defaults to False.
+        """
+        entry = {'source': [sourceHash, sourceStat.st_size, sourceStat.st_mtime_ns],
+            'output': [outputHash, destStat.st_size, destStat.st_mtime_ns], 'compact': compact}
+        if self.entries.get(key) != entry:
+            self.entries[key] = entry
+            self.modified = True
+    
+    def prune(self, keys, folders=None):
+        """Remove every dashboard that is not in `keys`.
+        
+        Parameters
+        ==========
+        keys : `set` of `str`
+            Paths, relative to the org's dashboards, of the dashboards to keep.
+        folders : `list` of `str`, optional
+            If given, only the dashboards of these folders are removed.
+        """
+        for key in set(self.entries) - keys:
+            if folders is not None and key.split('/', 1)[0] not in folders:
+                continue
+            del self.entries[key]
+            self.modified = True
+    
+    def save(self):
+        """Write the manifest to its file if it has been modified.
+        
+        Raises
+        ======
+        PermissionError:
+            Raised if the script does not have write permissions on the file or its
+            directory.
+        """
+        if not self.modified:
+            return
+        futil.writeIfChanged(self.path, json.dumps(self.entries, indent=2, sort_keys=True).encode('utf-8'))
+        self.modified = False
+
+
+class DashboardStore:
+    """Content-addressed store of the transformed dashboards.
+    
+    Each dashboard is stored once, in ``.objects/<xx>/<hash>.json`` inside
+    `dashboardsDir`, where ``hash`` is the sha256 hex digest of its content and
+    ``xx`` its first two characters. The dashboards that Grafana reads are hard
+    links to the stored files, so a dashboard that is provisioned to several
+    orgs or folders is written and stored only once.
+    
+    Parameters
+    ----------
+    dashboardsDir : `str`
+        The directory where Grafana will look for provisioned dashboards.
+    
+    Notes
+    =====
+    A stored dashboard that has no links other than its own is not provisioned
+    anywhere, and it is removed by `collect`. Dashboards are stored before they
+    are linked, so runs that share the store (like the ``--watch`` daemon and a
+    Puppet execution) must hold `lock` from the first `add` until `collect`
+    returns, or else one of them could remove what the other one is about to
+    link. If a hard link can't be created,
+    for example because the file system doesn't support them, the dashboard is
+    copied from the store instead.
+    """
+    
+    # Errors of os.link for which the dashboard is copied instead
+    _copyErrors = (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP)
+    
+    def __init__(self, dashboardsDir):
+        self.path = '{}/.objects'.format(dashboardsDir)
+    
+    @contextlib.contextmanager
+    def lock(self):
+        """Context manager that holds an exclusive lock of the store.
+        
+        The lock is a `fcntl.flock` of ``.lock`` in the store, so it's released
+        when the process ends, even if it's killed. It waits until any other run
+        that holds it releases it.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open('{}/.lock'.format(self.path), 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+    
+    def objectPath(self, digest):
+        """Return the path of the stored dashboard with the given hash."""
+        return '{}/{}/{}.json'.format(self.path, digest[:2], digest)
+    
+    def add(self, content):
+        """Store a dashboard, unless it is already stored.
+        
+        Parameters
+        ==========
+        content : `bytes`
+            Content of the transformed dashboard.
+        
+        Returns
+        =======
+        digest : `str`
+            sha256 hex digest of `content`.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.objectPath(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Also replaces a stored dashboard that was modified through one of its links
+        futil.writeIfChanged(path, content)
+        return digest
+    
+    def link(self, digest, dest):
+        """Make `dest` a hard link to the stored dashboard with the given hash.
+        
+        Grafana doesn't load a dashboard whose file is not newer than the last
+        time it was loaded, so if the stored dashboard is not newer than the
+        previous content of `dest`, its modification time is set to now. The
+        time is shared by every link to the stored dashboard, so Grafana also
+        loads it again, and saves a new version of it, in every other org and
+        folder where it's provisioned.
+        
+        Parameters
+        ==========
+        digest : `str`
+            sha256 hex digest of the stored dashboard.
+        dest : `str`
+            Path of the provisioned dashboard.
+        
+        Raises
+        ======
+        PermissionError:
+            Raised if the script does not have permission to write to the directory
+            of `dest`.
+        """
+        path = self.objectPath(digest)
+        try:
+            previous = os.stat(dest).st_mtime_ns
+        except FileNotFoundError:
+            previous = None
+        try:
+            if (futil.linkIfChanged(path, dest) and previous is not None
+                    and os.stat(path).st_mtime_ns <= previous):
+                os.utime(dest)
+        except OSError as exc:
+            if exc.errno not in self._copyErrors:
+                raise
+            with open(path, 'rb') as stored:
+                futil.writeIfChanged(dest, stored.read())
+    
+    def adopt(self, digest, dest):
+        """Share a provisioned dashboard that is not linked to the store.
+        
+        `dest` becomes the stored dashboard if there isn't one with its hash yet,
+        or else a link to it, without writing any content. Dashboards that were
+        copied before the store existed, or while links couldn't be created, are
+        shared this way.
+        
+        Parameters
+        ==========
+        digest : `str`
+            sha256 hex digest of the content of `dest`, already verified.
+        dest : `str`
+            Path of the provisioned dashboard.
+        """
+        path = self.objectPath(digest)
+        try:
+            if os.path.exists(path):
+                futil.linkIfChanged(path, dest)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.link(dest, path)
+        except OSError:
+            # It stays a copy, which is still a valid dashboard
+            pass
+    
+    def collect(self):
+        """Remove the stored dashboards that are not provisioned anywhere.
+        
+        Returns
+        =======
+        removed : `int`
+            Number of dashboards removed from the store.
+        """
+        removed = 0
+        try:
+            shards = [entry.path for entry in os.scandir(self.path) if entry.is_dir()]
+        except FileNotFoundError:
+            return removed
+        for shard in shards:
+            with os.scandir(shard) as entries:
+                for entry in entries:
+                    if (entry.name.endswith('.json') and not entry.name.startswith('.')
+                            and entry.stat().st_nlink == 1):
+                        os.remove(entry.path)
+                        removed += 1
+        return removed
+
+
+def scanDashboards(directory):
+    """Return the JSON files in a directory, excluding hidden files.
+    
+    Parameters
+    ==========
+    directory : `str`
+        Path of the directory which will be scanned.
+    
+    Returns
+    =======
+    dashboards : `dict`
+        Dictionary with one key per JSON file, where the key is the name of the
+        file and the value its `os.DirEntry`, which caches its stat. Empty if the
+        directory doesn't exist.
+    
+    See Also
+    ========
+    os.scandir
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name: entry for entry in entries if entry.name.endswith('.json')
+                and not entry.name.startswith('.') and entry.is_file()}
+    except FileNotFoundError:
+        return {}
 
 
-def provisionDashboards(orgName, grafanaFolders, orgInputDir, dashboardsDir):
+def provisionDashboards(orgName, grafanaFolders, orgInputDir, dashboardsDir, executor=None,
+        chunkSize=1, compact=False, store=None, partial=False):
     """Maintain the correct dashboards inside the folders in dashboardsDir.
     
     Copy dashboards to dashboardsDir without ID and UID when they need to be
     copied. Delete dashboards from dashboardsDir which do not exist in the input.
+    Whether a dashboard needs to be copied is checked with the org's
+    `DashboardManifest`. Dashboards are copied by adding them to `store` and
+    linking them to it.
+    
+    Each folder is synchronized in one pass: the input and the provisioned
+    folders are scanned once, and the stat of every file is read once. This
+    process only plans which dashboards have to be copied and deletes the old
+    ones, the copies are made by `executor` when it's given.
     
     Parameters
     ==========
@@ -285,6 +763,27 @@ def provisionDashboards(orgName, grafanaFolders, orgInputDir, dashboardsDir):
         The directory where the inputs for the given org are stored.
     dashboardsDir : `str`
         The directory where Grafana will look for provisioned dashboards.
+    executor : `concurrent.futures.ProcessPoolExecutor`, optional
+        Pool of processes that copy the dashboards. If None, they are copied by
+        this process.
+    chunkSize : `int`, optional
+        Number of dashboards sent to a process of `executor` at once. Defaults
+        to 1.
+    compact : `bool`, optional
+        If True, the dashboards are written without indentation. Defaults to
+        False.
+    store : `DashboardStore`, optional
+        Store of the transformed dashboards. Defaults to the store of
+        `dashboardsDir`.
+    partial : `bool`, optional
+        If True, `grafanaFolders` are only some of the org's folders, and the
+        manifest of the other folders is kept. Defaults to False.
+    
+    Returns
+    =======
+    counts : `dict`
+        Number of dashboards that were ``copied``, ``skipped`` because they didn't
+        change and ``deleted`` because they were removed from the input.
     
     Raises
     ======
@@ -296,30 +795,56 @@ def provisionDashboards(orgName, grafanaFolders, orgInputDir, dashboardsDir):
     JSONDecodeError:
         Raised if an input dashboard does not contain a valid JSON format.
     """
+    manifest = DashboardManifest('{}/{}/.manifest.json'.format(dashboardsDir, orgName))
+    if store is None:
+        store = DashboardStore(dashboardsDir)
+    keys = set()
+    copies = []
+    counts = {'copied': 0, 'skipped': 0, 'deleted': 0}
     for folder in grafanaFolders:
-        srcDbs = glob.glob('{}/dashboards/{}/*.json'.format(orgInputDir, folder))
-        
-        destDir ='{}/{}/{}'.format(dashboardsDir, orgName, folder)
-        destDbs = glob.glob('{}/*.json'.format(destDir))
+        srcDbs = scanDashboards('{}/dashboards/{}'.format(orgInputDir, folder))
+        destDir = '{}/{}/{}'.format(dashboardsDir, orgName, folder)
+        destDbs = scanDashboards(destDir)
         
-        shortSrcDbs = [os.path.basename(dashboard) for dashboard in srcDbs]
-        shortDestDbs = [os.path.basename(dashboard) for dashboard in destDbs]
-        
-        for d in range(len(shortSrcDbs)):
-            if shortSrcDbs[d] in shortDestDbs:
-                i = shortDestDbs.index(shortSrcDbs[d])
-                if needsProvisioning(srcDbs[d], destDbs[i]):
-                    copyDashboardWithoutIds(srcDbs[d], destDbs[i])
+        for name, source in srcDbs.items():
+            key = '{}/{}'.format(folder, name)
+            keys.add(key)
+            dest = '{}/{}'.format(destDir, name)
+            current = destDbs.pop(name, None)
+            sourceStat = source.stat()
+            destStat = None if current is None else current.stat()
+            if manifest.needsProvisioning(key, source.path, sourceStat, dest, destStat, compact):
+                copies.append((key, source.path, sourceStat, dest))
             else:
-                copyDashboardWithoutIds(srcDbs[d], '{}/{}'.format(destDir, shortSrcDbs[d]))
+                if destStat.st_nlink == 1:
+                    store.adopt(manifest.entries[key]['output'][0], dest)
+                counts['skipped'] += 1
         
-        # Remove deleted files from provisioning
-        for old in range(len(destDbs)):
-            if not shortDestDbs[old] in shortSrcDbs:
-                os.remove(destDbs[old])
+        # Remove deleted files from provisioning, the ones left weren't in the input
+        for old in destDbs.values():
+            os.remove(old.path)
+            counts['deleted'] += 1
+    
+    sources = [source for key, source, sourceStat, dest in copies]
+    stores = [store] * len(copies)
+    compacts = [compact] * len(copies)
+    if executor is None or len(copies) < 2:
+        hashes = map(storeDashboardWithoutIds, sources, stores, compacts)
+    else:
+        hashes = executor.map(storeDashboardWithoutIds, sources, stores, compacts,
+            chunksize=chunkSize)
+    # The links are made by this process once every dashboard is stored
+    for (key, source, sourceStat, dest), (sourceHash, outputHash) in zip(copies, list(hashes)):
+        store.link(outputHash, dest)
+        manifest.set(key, sourceStat, sourceHash, os.stat(dest), outputHash, compact)
+        counts['copied'] += 1
+    
+    manifest.prune(keys, grafanaFolders if partial else None)
+    manifest.save()
+    return counts
 
 
-def provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir):
+def provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir, config):
     """Create folder structure in dashboardsDir and configure each folder route.
     
     Uses ``dashboardRoutesTemplate.yaml`` as a template to create the folder
@@ -338,6 +863,13 @@ def provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir)
         The directory where the inputs for the given org are stored.
     dashboardsDir : `str`
         The directory where Grafana will look for provisioned dashboards.
+    config : `dict`
+        The contents of ``config.yaml``, see `runContext.RunContext`.
+    
+    Returns
+    =======
+    written : `bool`
+        True if the folder routes file was written, False if it didn't change.
     
     Raises
     ======
@@ -383,7 +915,7 @@ def provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir)
         folderPath = '{}/{}'.format(orgDashboardsPath, grafanaFolders[i])
         provider['options']['path'] = folderPath
         
-        provider['updateIntervalSeconds'] = yutil.config['updateIntervalSeconds']
+        provider['updateIntervalSeconds'] = config['updateIntervalSeconds']
         provider['orgId'] = orgId
         provider['folder'] = grafanaFolders[i]
         provider['name'] = '{}_{}'.format(orgName, grafanaFolders[i])
@@ -394,87 +926,355 @@ def provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir)
         if not os.path.isdir(folderPath):
             os.mkdir(folderPath)
     
-    yutil.writeYamlContent('/etc/grafana/provisioning/dashboards/{}_dashboardRoutes.yaml'
-        .format(orgName), routeYaml)
+    return yutil.writeYamlContent('{}/dashboards/{}_dashboardRoutes.yaml'
+        .format(config['grafanaProvisioningDir'], orgName), routeYaml)
 
 
-if __name__ == '__main__':
-    gapi.timeout = yutil.config['timeout']
-    provisioningDir = yutil.config['provisioningDir']
-    inputsDir = '{}/inputs'.format(provisioningDir)
-    dashboardsDir = yutil.config['dashboardsDir']
+def provisionOrgInputs(orgInputDir, context, provisionedOrgs, orgIds, executor=None, chunkSize=1,
+        compact=False, store=None):
+    """Provision the org, accounts, datasources and dashboards of one input.
+    
+    Parameters
+    ==========
+    orgInputDir : `str`
+        The directory where the inputs for this org are stored.
+    context : `runContext.RunContext`
+        Configuration and credentials of the run.
+    provisionedOrgs : `dict`
+        Orgs in the provisioning configuration, see `provisionOrg`.
+    orgIds : `dict`
+        Dictionary containing all orgs in Grafana, as returned by
+        `grafanaAPI.getOrgIds`.
+    executor : `concurrent.futures.ProcessPoolExecutor`, optional
+        Pool of processes that copy the dashboards, see `provisionDashboards`.
+    chunkSize : `int`, optional
+        Number of dashboards sent to a process of `executor` at once. Defaults
+        to 1.
+    compact : `bool`, optional
+        If True, the dashboards are written without indentation. Defaults to
+        False.
+    store : `DashboardStore`, optional
+        Store of the transformed dashboards. Defaults to the store of the
+        configured ``dashboardsDir``.
+    
+    Returns
+    =======
+    orgName : `str`
+        Name of the Grafana organization.
+    
+    Raises
+    ======
+    ValueError
+        Raised if ``org.yaml`` is invalid or the org is duplicated. See
+        `provisionOrg`.
+    grafanaAPI.APIError
+        Raised if a request replies with a status code in the 4XX or 5XX range.
+    """
+    provisioningDir = context.provisioningDir
+    dashboardsDir = context.config['dashboardsDir']
+    
+    orgId, orgName = provisionOrg(orgInputDir, context, provisionedOrgs, orgIds)
+    
+    # Make symlink for account file
+    symlink = '{}/accounts/{}_accounts.yaml'.format(provisioningDir, orgName)
+    if not os.path.exists(symlink):
+        # If the symlink exists but is broken, remove it to add the new one
+        if os.path.lexists(symlink):
+            os.remove(symlink)
+        os.symlink('{}/accounts.yaml'.format(orgInputDir), symlink)
+    
+    # Check if there is something new to provision
+    stateFile = '{}/.state.yaml'.format(orgInputDir)
+    if os.path.exists(stateFile):
+        state = yutil.getYamlContent(stateFile)
+    else:
+        state = {}
     
-    user, password = yutil.getApiCredentials()
+    # Datasources
+    dSrcFile = '{}/{}'.format(orgInputDir, 'datasources.yaml')
+    dSrcYaml = yutil.getYamlContent(dSrcFile)
+    modified = False
+    # Grafana only needs a restart if one of its configuration files changed
+    restart = False
+    now = datetime.now()
+    if 'datasourcesDate' in state:
+        # time since last modification of file (float)
+        lastModified = datetime.utcfromtimestamp(os.path.getmtime(dSrcFile))
+        lastProvisioned = datetime.strptime(state['datasourcesDate'], '%Y-%m-%dT%H:%M:%S')
+        if lastModified > lastProvisioned:
+            restart |= provisionDatasources(orgId, orgName, dSrcYaml, context.config)
+            state['datasourcesDate'] = now.isoformat('T', 'seconds')
+            modified = True
+    else:
+        restart |= provisionDatasources(orgId, orgName, dSrcYaml, context.config)
+        state['datasourcesDate'] = now.isoformat('T', 'seconds')
+        modified = True
+    
+    # Dashboards
+    grafanaFolders = getDirList('{}/dashboards'.format(orgInputDir))
+    grafanaFolders.sort()
+    if 'dashboardFolders' in state:
+        # We sort them both to not depend on implementation details,
+        # but they seem to come sorted from the beginning
+        state['dashboardFolders'].sort()
+        if state['dashboardFolders'] != grafanaFolders:
+            restart |= provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir,
+                context.config)
+            state['dashboardFolders'] = grafanaFolders
+            modified = True
+    else:
+        restart |= provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir,
+            context.config)
+        state['dashboardFolders'] = grafanaFolders
+        modified = True
+        
+    counts = provisionDashboards(orgName, grafanaFolders, orgInputDir, dashboardsDir, executor,
+        chunkSize, compact, store)
+    print('Org "{}": {} dashboards copied, {} skipped, {} deleted.'
+        .format(orgName, counts['copied'], counts['skipped'], counts['deleted']))
+    
+    if modified:
+        yutil.writeYamlContent(stateFile, state)
+        
+        ignorePath = '{}/.gitignore'.format(orgInputDir)
+        if not os.path.exists(ignorePath):
+            with open(ignorePath, 'w') as ignore:
+                ignore.write('.state.yaml\n')
+    
+    if restart:
+        # Tell Puppet to restart Grafana.
+        futil.writeIfChanged('{}/restart.txt'.format(provisioningDir), b'restart\n')
+    return orgName
+
+
+def createExecutor(config):
+    """Return the pool of processes that copy the dashboards, or None.
+    
+    Parameters
+    ==========
+    config : `dict`
+        The contents of ``config.yaml``, where ``dashboardWorkers`` is the number
+        of processes.
+    
+    Returns
+    =======
+    executor : `concurrent.futures.ProcessPoolExecutor` or `None`
+        The pool of processes, or None if ``dashboardWorkers`` is 1 and the
+        dashboards are copied by the main process.
+    """
+    workers = config.get('dashboardWorkers', 1)
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+
+def provisionInputs(context, executor=None):
+    """Provision the org, accounts, datasources and dashboards of every input.
+    
+    This is the main body of the script, which can also be run by other scripts
+    in the same process, see ``gpProvision.py``.
+    
+    Parameters
+    ==========
+    context : `runContext.RunContext`
+        Configuration and credentials of the run.
+    executor : `concurrent.futures.ProcessPoolExecutor`, optional
+        Pool of processes that copy the dashboards, which is left running. If
+        None, a pool is created with `createExecutor` and shut down at the end.
+    
+    Returns
+    =======
+    orgIds : `dict`
+        Dictionary containing all orgs in Grafana, as returned by
+        `grafanaAPI.getOrgIds`, including the orgs created by this function.
+    orgFiles : `dict`
+        Contents of the ``org.yaml`` file of every input, indexed by the real path
+        of the file, so that it doesn't need to be parsed again.
+    
+    Raises
+    ======
+    ValueError
+        Raised if an ``org.yaml`` file is invalid or an org is duplicated. See
+        `provisionOrg`.
+    grafanaAPI.APIError
+        Raised if a request replies with a status code in the 4XX or 5XX range.
+    """
+    inputsDir = '{}/inputs'.format(context.provisioningDir)
     
     # Get folder names, these are inputs from different organizations
     dirs = getDirList(inputsDir)
     
+    # Get the ids of all the orgs in Grafana at once
+    orgIds = gapi.getOrgIds(context.user, context.password)
+    
+    # Dashboards are transformed by a pool of processes, shared by every org
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = createExecutor(context.config)
+    chunkSize = context.config.get('dashboardChunkSize', 1)
+    compact = context.config.get('compactDashboards', False)
+    store = DashboardStore(context.config['dashboardsDir'])
+    
     # Loop through organizations
     provisionedOrgs = {}
-    for org in dirs:
-        orgInputDir = '{}/{}'.format(inputsDir, org)
-        
-        orgId, orgName = provisionOrg(orgInputDir, user, password, provisionedOrgs)
-        
-        # Make symlink for account file
-        symlink = '{}/accounts/{}_accounts.yaml'.format(provisioningDir, orgName)
-        if not os.path.exists(symlink):
-            # If the symlink exists but is broken, remove it to add the new one
-            if os.path.lexists(symlink):
-                os.remove(symlink)
-            os.symlink('{}/accounts.yaml'.format(orgInputDir), symlink)
-        
-        # Check if there is something new to provision
-        stateFile = '{}/.state.yaml'.format(orgInputDir)
-        if os.path.exists(stateFile):
-            state = yutil.getYamlContent(stateFile)
-        else:
-            state = {}
-        
-        # Datasources
-        dSrcFile = '{}/{}'.format(orgInputDir, 'datasources.yaml')
-        dSrcYaml = yutil.getYamlContent(dSrcFile)
-        modified = False
-        now = datetime.now()
-        if 'datasourcesDate' in state:
-            # time since last modification of file (float)
-            lastModified = datetime.utcfromtimestamp(os.path.getmtime(dSrcFile))
-            lastProvisioned = datetime.strptime(state['datasourcesDate'], '%Y-%m-%dT%H:%M:%S')
-            if lastModified > lastProvisioned:
-                provisionDatasources(orgId, orgName, dSrcYaml)
-                state['datasourcesDate'] = now.isoformat('T', 'seconds')
-                modified = True
-        else:
-            provisionDatasources(orgId, orgName, dSrcYaml)
-            state['datasourcesDate'] = now.isoformat('T', 'seconds')
-            modified = True
-        
-        # Dashboards
-        grafanaFolders = getDirList('{}/dashboards'.format(orgInputDir))
-        grafanaFolders.sort()
-        if 'dashboardFolders' in state:
-            # We sort them both to not depend on implementation details,
-            # but they seem to come sorted from the beginning
-            state['dashboardFolders'].sort()
-            if state['dashboardFolders'] != grafanaFolders:
-                provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir)
-                state['dashboardFolders'] = grafanaFolders
-                modified = True
+    orgFiles = {}
+    try:
+        with store.lock():
+            for org in dirs:
+                orgInputDir = '{}/{}'.format(inputsDir, org)
+                orgName = provisionOrgInputs(orgInputDir, context, provisionedOrgs, orgIds, executor,
+                    chunkSize, compact, store)
+                orgFiles[os.path.realpath('{}/org.yaml'.format(orgInputDir))] = {
+                    orgName: provisionedOrgs[orgName]}
+            removed = store.collect()
+    finally:
+        if ownExecutor and executor is not None:
+            executor.shutdown()
+    if removed:
+        print('{} unused dashboards removed from the store.'.format(removed))
+    gapi.idCache.save()
+    return orgIds, orgFiles
+
+
+def changedInputs(inputsDir, paths):
+    """Group the paths that changed in the inputs by the org and folder they affect.
+    
+    A change in a dashboard of a folder only affects the dashboards of that
+    folder. Any other change, like ``org.yaml``, ``datasources.yaml`` or a folder
+    that was created or deleted, affects the whole org.
+    
+    Parameters
+    ==========
+    inputsDir : `str`
+        The ``inputs`` directory.
+    paths : `set` of `str`
+        Paths that changed inside `inputsDir`.
+    
+    Returns
+    =======
+    changes : `dict`
+        Dictionary with one key per org directory that changed, whose value is the
+        `set` of folders whose dashboards changed, or None if the whole org has to
+        be provisioned. If `inputsDir` itself is in `paths`, every org is
+        included.
+    """
+    changes = {}
+    for path in paths:
+        parts = os.path.relpath(path, inputsDir).split(os.sep)
+        if parts == ['.']:
+            for org in getDirList(inputsDir):
+                changes[org] = None
+            break
+        if parts[0] in ('..', '') or any(part.startswith('.') for part in parts):
+            continue
+        org = parts[0]
+        if len(parts) >= 4 and parts[1] == 'dashboards':
+            if org not in changes:
+                changes[org] = set()
+            if changes[org] is not None:
+                changes[org].add(parts[2])
         else:
-            provisionFolders(orgId, orgName, grafanaFolders, orgInputDir, dashboardsDir)
-            state['dashboardFolders'] = grafanaFolders
-            modified = True
-            
-        provisionDashboards(orgName, grafanaFolders, orgInputDir, dashboardsDir)
+            changes[org] = None
+    return changes
+
+
+def watchInputs(context, debounce=2, pollInterval=5):
+    """Provision every input, and then each input again as soon as it changes.
+    
+    The ``inputs`` directory is watched with `inputWatcher.createWatcher`. Every
+    burst of changes (see `inputWatcher.waitForChanges`) is grouped with
+    `changedInputs`: only the orgs that changed are provisioned again, and when
+    only the dashboards of some folders changed, just those folders are
+    synchronized. Errors are printed and the org is provisioned again on its next
+    change. This function only returns when it's interrupted.
+    
+    Parameters
+    ==========
+    context : `runContext.RunContext`
+        Configuration and credentials of the run.
+    debounce : `float`, optional
+        Seconds without changes after which a burst of changes is provisioned.
+        Defaults to 2.
+    pollInterval : `float`, optional
+        Seconds between scans of the inputs if inotify is not available. Defaults
+        to 5.
+    
+    Raises
+    ======
+    ValueError
+        Raised if an ``org.yaml`` file is invalid or an org is duplicated in the
+        first run.
+    grafanaAPI.APIError
+        Raised if a request of the first run replies with a status code in the
+        4XX or 5XX range.
+    """
+    inputsDir = '{}/inputs'.format(context.provisioningDir)
+    dashboardsDir = context.config['dashboardsDir']
+    chunkSize = context.config.get('dashboardChunkSize', 1)
+    compact = context.config.get('compactDashboards', False)
+    store = DashboardStore(dashboardsDir)
+    executor = createExecutor(context.config)
+    
+    # Watch before the first run, so that nothing that changes during it is missed
+    watcher = iwatch.createWatcher(inputsDir, pollInterval)
+    try:
+        orgIds, orgFiles = provisionInputs(context, executor)
+        # Name of the org of every input directory
+        orgNames = {}
+        for org in getDirList(inputsDir):
+            orgFile = orgFiles.get(os.path.realpath('{}/{}/org.yaml'.format(inputsDir, org)))
+            if orgFile:
+                orgNames[org] = next(iter(orgFile))
+        print('Watching {} for changes.'.format(inputsDir))
         
-        if modified:
-            yutil.writeYamlContent(stateFile, state)
-            
-            ignorePath = '{}/.gitignore'.format(orgInputDir)
-            if not os.path.exists(ignorePath):
-                with open(ignorePath, 'w') as ignore:
-                    ignore.write('.state.yaml\n')
-            
-            # Tell Puppet to restart Grafana.
-            with open('{}/restart.txt'.format(provisioningDir), 'w') as restart:
-                restart.write('restart\n')
+        while True:
+            changes = changedInputs(inputsDir, iwatch.waitForChanges(watcher, debounce))
+            with store.lock():
+                for org, folders in sorted(changes.items()):
+                    orgInputDir = '{}/{}'.format(inputsDir, org)
+                    if not os.path.isdir(orgInputDir):
+                        orgNames.pop(org, None)
+                        continue
+                    try:
+                        orgName = orgNames.get(org)
+                        if folders is not None and orgName is not None:
+                            folders = sorted(folder for folder in folders
+                                if os.path.isdir('{}/dashboards/{}'.format(orgInputDir, folder))
+                                and os.path.isdir('{}/{}/{}'.format(dashboardsDir, orgName, folder)))
+                            counts = provisionDashboards(orgName, folders, orgInputDir, dashboardsDir,
+                                executor, chunkSize, compact, store, partial=True)
+                            print('Org "{}": {} dashboards copied, {} skipped, {} deleted.'
+                                .format(orgName, counts['copied'], counts['skipped'], counts['deleted']))
+                            continue
+                        # The other orgs, to check that this one is not a duplicate
+                        provisionedOrgs = {name: None for other, name in orgNames.items() if other != org}
+                        orgNames[org] = provisionOrgInputs(orgInputDir, context, provisionedOrgs, orgIds,
+                            executor, chunkSize, compact, store)
+                    except Exception as exc:
+                        print('The input {} could not be provisioned, it will be provisioned again when it '
+                            'changes: {!r}'.format(orgInputDir, exc))
+                store.collect()
+            gapi.idCache.save()
+    finally:
+        watcher.close()
+        if executor is not None:
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Provision the orgs, datasources and dashboards of the inputs.')
+    parser.add_argument('--watch', action='store_true',
+        help='Keep running and provision the inputs again as soon as they change.')
+    args = parser.parse_args()
+    
+    context = RunContext()
+    # Write the statistics of the API requests when the script ends, even if it fails
+    atexit.register(gapi.dumpMetrics, '{}/gpInputsMetrics.json'.format(context.config['metricsDir']))
+    if args.watch:
+        # Stop the daemon cleanly, so the metrics are written
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            watchInputs(context, context.config.get('watchDebounceSeconds', 2),
+                context.config.get('watchPollSeconds', 5))
+        except KeyboardInterrupt:
+            pass
+    else:
+        provisionInputs(context)
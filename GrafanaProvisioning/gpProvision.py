@@ -0,0 +1,39 @@
+"""Runs gpInputs and then gpAccounts in a single process.
+
+This script is meant to run it's main body on every Puppet execution, instead of
+running ``gpInputs.py`` and ``gpAccounts.py`` one after the other. It does the
+same as both scripts, but the configuration and credentials are loaded once, the
+``org.yaml`` files parsed by gpInputs are not parsed again by gpAccounts, the
+``id`` of the orgs is loaded from Grafana once and every request is made through
+the same pool of connections.
+
+The standalone scripts can still be used, for example to run gpAccounts with
+``--dry-run``.
+
+Functions
+=========
+"""
+import sys
+import atexit
+import argparse
+import grafanaAPI as gapi
+from runContext import RunContext
+import gpInputs
+import gpAccounts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Provision the inputs, organizations and accounts in Grafana.')
+    parser.add_argument('--full', action='store_true',
+        help='Review every org, even if its configuration did not change since the last run.')
+    args = parser.parse_args()
+    
+    context = RunContext()
+    # Write the statistics of the API requests when the script ends, even if it fails
+    atexit.register(gapi.dumpMetrics, '{}/gpProvisionMetrics.json'.format(context.config['metricsDir']))
+    
+    orgIds, orgFiles = gpInputs.provisionInputs(context)
+    errors, accountErrors = gpAccounts.provisionAccounts(context, full=args.full, orgIds=orgIds,
+        orgFiles=orgFiles)
+    if errors or accountErrors:
+        sys.exit(1)
@@ -22,10 +22,12 @@ before opening Grafana's port (default is 3000) on the firewall.
 Functions
 =========
 """
+import atexit
 import os
 from datetime import datetime
 import grafanaAPI as gapi
 import yamlUtility as yutil
+from runContext import RunContext
 
 
 def changeAdminPassword(newPasswd, user, password):
@@ -101,15 +103,13 @@ def renameAdminUser(data, user, password):
             ' or it might already be provisioned.')
 
 
-def renameKioskOrg(user, password):
+def renameKioskOrg(context):
     """Rename the default organization (id=1) to what is in ``admins/_kiosk.yaml``.
     
     Parameters
     ==========
-    user : `str`
-        ``login`` of the Grafana account that is making the API request.
-    password : `str`
-        ``password`` of the Grafana account that is making the API request.
+    context : `runContext.RunContext`
+        Configuration of the run, the request is made with its API account.
     
     Raises
     ======
@@ -123,9 +123,9 @@ def renameKioskOrg(user, password):
     grafanaAPI.APIError
         Raised if the request replies with a status code in the 4XX or 5XX range.
         The causes include: The first organization does not exist, invalid 
-        credentials (`user` and `password`), the user doesn't have permission to
-        make this request or the server is not responding. Check the error messages
-        for more information.
+        credentials of the API account, the user doesn't have permission to make
+        this request or the server is not responding. Check the error messages for
+        more information.
     
     See Also
     ========
@@ -135,6 +135,7 @@ def renameKioskOrg(user, password):
     =====
     Affects the current context organization for the user.
     """
+    adminsDir = context.adminsDir
     try:
         kiosk = yutil.getYamlContent('{}/_kiosk.yaml'.format(adminsDir))
     except FileNotFoundError as exc:
@@ -150,7 +151,7 @@ def renameKioskOrg(user, password):
     
     data = {'name':orgName}
     try:
-        r = gapi.request('put', 'orgs/1', user, password, data)
+        r = gapi.request('put', 'orgs/1', context.user, context.password, data)
     except gapi.APIError as exc:
         print('Error: There was an error when trying to change the default organization\'s name. Check '
             'the requests\' output below to see Grafana\'s response. There might be a problem with '
@@ -162,17 +163,10 @@ _path = os.path.abspath(os.path.dirname(__file__))
 _lastInitialization = '{}/lastInitialization.txt'.format(_path)
 if __name__ == '__main__' and (not os.path.exists(_lastInitialization)
         or os.path.getsize(_lastInitialization) == 0):
-    gapi.timeout = yutil.config['timeout']
-    adminsDir = '{}/admins'.format(yutil.config['provisioningDir'])
-    
-    try:
-        supers = yutil.getYamlContent('{}/_superAdmins.yaml'.format(adminsDir))
-    except FileNotFoundError as exc:
-        print('The file "{}/_superAdmins.yaml" is missing! Make sure that the directory is set correctly in '
-            '"config.yaml" and that the file has the correct name. It must contain information for the two '
-            'Grafana Admin accounts, the main one (id=1) and the API account which the provisioning script '
-            'should use. See the structure in the documentation and default files.'.format(adminsDir))
-        raise exc
+    context = RunContext()
+    # Write the statistics of the API requests when the script ends, even if it fails
+    atexit.register(gapi.dumpMetrics, '{}/gpSetupMetrics.json'.format(context.config['metricsDir']))
+    supers = context.superAdmins
     
     grafAdmin = supers['grafanaAdmin']
     admLogin = 'admin'
@@ -187,7 +181,7 @@ if __name__ == '__main__' and (not os.path.exists(_lastInitialization)
     api = supers['api']
     gapi.createGrafanaAdmin(api, admLogin, admPasswd)
     
-    renameKioskOrg(api['login'], api['password'])
+    renameKioskOrg(context)
     
     with open('{}/lastInitialization.txt'.format(_path),
             'w') as provisioned:
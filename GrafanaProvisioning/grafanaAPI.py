@@ -2,63 +2,740 @@
 
 This module is intended to be used by the Grafana Provisioning scripts to
 communicate with Grafana's API through HTTP requests. If you wish to use HTTPS
-all you need to do is add an `s` to the string returned by the _apiUrl function,
-note that this is not tested though.
+all you need to do is change the global variable `url` (``grafanaUrl`` in
+``config.yaml``), note that this is not tested though.
 
 Notes
 =====
 The default timeout for API requests is 5 seconds. This can be changed through
 the global variable `timeout`.
 
+Requests are made through a `GrafanaClient`, which keeps a pool of open
+connections to Grafana and sends the credentials in the ``Authorization``
+header. The module level functions use a default client for each pair of
+credentials, see `getClient`. The pool size can be changed through the global
+variable `poolSize` before the first request is made, or with `configure`.
+
+Requests that fail because Grafana is not reachable or is restarting (status
+codes 429, 502, 503 and 504) are retried up to `retries` times, waiting an
+exponential backoff with jitter between attempts, or the time in the
+``Retry-After`` header when Grafana sends one. Status codes and errors after the
+connection was established are only retried for idempotent methods, since a
+POST could have been applied before failing. After
+`breakerThreshold` consecutive calls fail this way, the circuit breaker opens and
+every request fails immediately with `CircuitOpenError` for `breakerReset`
+seconds, instead of waiting for a timeout on each of them.
+
+Every request, including retries, takes a token from a rate limiter before being
+sent. Reads (GET) and writes (every other method) have separate token buckets,
+because writes are what lock Grafana's database. Their rate in requests per
+second and burst size are set with `readRate`, `readBurst`, `writeRate` and
+`writeBurst`, a rate of 0 disables the limit.
+
+The ``id`` of users and organizations never changes once they are created, so
+they are kept in `idCache`, which `configure` stores in the provisioning
+directory so it's reused by the next runs. `getExistingUserId` and `getOrgId`
+check the cache first and the functions that create users and orgs update it.
+Cached ids are validated lazily: when a request with a cached id replies with
+a 404 the entry is evicted and the id is looked up again.
+
+Every HTTP exchange with Grafana is recorded in `metrics`, grouped by endpoint
+template (e.g. ``GET users/{id}/orgs``): the number of requests, their status
+codes, bytes sent and received, and a histogram of their latency. They can be
+obtained with `getMetrics` and written to a JSON file with `dumpMetrics`.
+Templates never include query strings or credentials.
+
+Lists that Grafana paginates (users, orgs and the members of an org) are read
+with the generators `iterUsers`, `iterOrgs` and `iterOrgMembers`, which request
+the next page of `pageSize` items only when the previous one has been consumed.
+
 Functions
 =========
 """
+import os
+import re
+import time
+import json
+import base64
+import random
+import itertools
+import threading
+import email.utils
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import fileUtility as futil
 
+url = 'http://localhost:3000/api/'  # Base url of Grafana's API
 timeout = 5  # Default timeout
+poolSize = 10  # Default number of connections kept open by each client
 head = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-methods = { 'get': requests.get,
-            'post': requests.post,
-            'put': requests.put,
-            'delete': requests.delete,
-            'patch': requests.patch}
+methods = ('get', 'post', 'put', 'delete', 'patch')
+idempotentMethods = ('get', 'put', 'delete')
+retryStatusCodes = (429, 502, 503, 504)
+retries = 3  # Default number of retries after the first attempt
+retryBackoff = 0.5  # Base of the exponential backoff, in seconds
+retryBackoffMax = 30  # Maximum wait between attempts, in seconds
+breakerThreshold = 5  # Failed calls in a row before the circuit breaker opens
+breakerReset = 60  # Seconds before a request is attempted again
+readRate = 0  # Read requests per second, 0 means no limit
+readBurst = 10  # Read requests that can be made at once before limiting
+writeRate = 0  # Write requests per second, 0 means no limit
+writeBurst = 5  # Write requests that can be made at once before limiting
+pageSize = 1000  # Default number of items requested on each page of a search
+
+_clients = {}
+_clientsLock = threading.Lock()
+
+
+class IdCache:
+    """Persistent cache of the ``id`` of Grafana users and organizations.
+    
+    Ids are stored by kind: ``users`` maps a user's ``login`` to its ``id`` and
+    ``orgs`` maps an organization's name to its ``id``. The cache is loaded from
+    a JSON file, and only written back to it with `save` when it changed.
+    
+    Parameters
+    ----------
+    path : `str`, optional
+        Path of the JSON file where the cache is stored. If None, the cache is only
+        kept in memory.
+    
+    Notes
+    =====
+    If the file is missing or can't be read the cache starts empty, since every
+    id can be looked up again in Grafana.
+    """
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.ids = {'users': {}, 'orgs': {}}
+        self.modified = False
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as cacheFile:
+                    for kind, ids in json.load(cacheFile).items():
+                        self.ids.setdefault(kind, {}).update(ids)
+            except (ValueError, OSError):
+                print('Warning: The cache of Grafana ids at {} could not be read, it will be created '
+                    'again.'.format(path))
+    
+    def get(self, kind, key):
+        """Return the cached ``id`` of a user or org, or None if it's not cached.
+        
+        Parameters
+        ==========
+        kind : {'users', 'orgs'}
+            Kind of object whose ``id`` is being retrieved.
+        key : `str`
+            ``login`` of the user or name of the org.
+        
+        Returns
+        =======
+        id : `int` or `None`
+            The cached ``id``, or None if it's not in the cache.
+        """
+        with self._lock:
+            return self.ids[kind].get(key)
+    
+    def set(self, kind, key, value):
+        """Store the ``id`` of a user or org.
+        
+        Parameters
+        ==========
+        kind : {'users', 'orgs'}
+            Kind of object whose ``id`` is being stored.
+        key : `str`
+            ``login`` of the user or name of the org.
+        value : `int`
+            ``id`` of the user or org in Grafana.
+        """
+        with self._lock:
+            if self.ids[kind].get(key) != value:
+                self.ids[kind][key] = value
+                self.modified = True
+    
+    def evict(self, kind, key, value=None):
+        """Remove the ``id`` of a user or org from the cache.
+        
+        Parameters
+        ==========
+        kind : {'users', 'orgs'}
+            Kind of object whose ``id`` is being removed.
+        key : `str`
+            ``login`` of the user or name of the org.
+        value : `int`, optional
+            If given, the entry is only removed if it has this ``id``.
+        
+        Returns
+        =======
+        evicted : `bool`
+            True if the entry was in the cache and has been removed.
+        """
+        with self._lock:
+            cached = self.ids[kind].get(key)
+            if cached is None or (value is not None and cached != value):
+                return False
+            del self.ids[kind][key]
+            self.modified = True
+            return True
+    
+    def save(self):
+        """Write the cache to its file if it has been modified.
+        
+        Raises
+        ======
+        PermissionError:
+            Raised if the module does not have write permissions on the cache file
+            or its directory.
+        """
+        if self.path is None or not self.modified:
+            return
+        with self._lock:
+            futil.writeIfChanged(self.path, json.dumps(self.ids, indent=2, sort_keys=True).encode('utf-8'))
+            self.modified = False
+
+
+idCache = IdCache()
+
+
+class Metrics:
+    """Per endpoint statistics of the requests made to Grafana's API.
+    
+    Parameters
+    ----------
+    buckets : `tuple` of `float`, optional
+        Upper bounds, in seconds, of the buckets of the latency histogram. A last
+        bucket holds the requests slower than the last bound.
+    
+    Notes
+    =====
+    Requests are grouped by method and endpoint template, which is the path of
+    the request without its query string, and with numeric ids and org names
+    replaced by ``{id}`` and ``{name}``. This way the statistics never contain
+    logins, passwords or other values sent to Grafana.
+    """
+    
+    def __init__(self, buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.buckets = buckets
+        self.endpoints = {}
+        self._lock = threading.Lock()
+    
+    def record(self, method, api, status, latency, sent=0, received=0):
+        """Add a request to the statistics of its endpoint template.
+        
+        Parameters
+        ==========
+        method : `str`
+            HTTP method of the request.
+        api : `str`
+            Suffix of the url that was requested.
+        status : `int` or `str`
+            Status code of the response, or the name of the exception raised if
+            there wasn't one.
+        latency : `float`
+            Seconds that the request took.
+        sent : `int`, optional
+            Size in bytes of the body of the request.
+        received : `int`, optional
+            Size in bytes of the body of the response.
+        """
+        endpoint = endpointTemplate(method, api)
+        bucket = next((i for i, bound in enumerate(self.buckets) if latency <= bound), len(self.buckets))
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {'count': 0, 'status': {}, 'bytesSent': 0,
+                    'bytesReceived': 0, 'latencyTotal': 0.0, 'latencyMax': 0.0,
+                    'latencyHistogram': [0] * (len(self.buckets) + 1)}
+            stats['count'] += 1
+            stats['status'][str(status)] = stats['status'].get(str(status), 0) + 1
+            stats['bytesSent'] += sent
+            stats['bytesReceived'] += received
+            stats['latencyTotal'] += latency
+            stats['latencyMax'] = max(stats['latencyMax'], latency)
+            stats['latencyHistogram'][bucket] += 1
+    
+    def summary(self):
+        """Return a copy of the statistics that can be serialized to JSON.
+        
+        Returns
+        =======
+        summary : `dict`
+            Contains the bounds of the latency ``buckets``, the ``total`` number
+            of requests and the statistics of each endpoint template under
+            ``endpoints``.
+        """
+        with self._lock:
+            endpoints = {endpoint: dict(stats, status=dict(stats['status']),
+                latencyHistogram=list(stats['latencyHistogram']))
+                for endpoint, stats in self.endpoints.items()}
+        return {'buckets': list(self.buckets) + ['inf'],
+            'total': sum(stats['count'] for stats in endpoints.values()),
+            'endpoints': endpoints}
+    
+    def reset(self):
+        """Remove all the recorded statistics."""
+        with self._lock:
+            self.endpoints = {}
+
 
+metrics = Metrics()
 
-def _apiUrl(api, user, password):
-    """Return the url needed to make an API request with basic authentication.
+
+def endpointTemplate(method, api):
+    """Return the endpoint template of a request, used to group its metrics.
+    
+    Parameters
+    ==========
+    method : `str`
+        HTTP method of the request.
+    api : `str`
+        Suffix of the url of the request, i.e. what comes after ``[...]/api/``.
+    
+    Returns
+    =======
+    endpoint : `str`
+        Method and path of the request without the query string, where numeric
+        ids are replaced by ``{id}`` and org names by ``{name}``. For example,
+        ``GET users/{id}/orgs`` for a request to ``users/5/orgs``.
+    """
+    path = api.split('?', 1)[0]
+    if path.startswith('orgs/name/'):
+        path = 'orgs/name/{name}'
+    path = re.sub(r'(^|/)\d+(?=/|$)', r'\1{id}', path)
+    return '{} {}'.format(method.upper(), path)
+
+
+def getMetrics():
+    """Return the statistics of the requests made since the start of the run.
+    
+    Returns
+    =======
+    summary : `dict`
+        See `Metrics.summary`.
+    """
+    return metrics.summary()
+
+
+def dumpMetrics(path):
+    """Write the statistics of the requests made during the run to a JSON file.
+    
+    Parameters
+    ==========
+    path : `str`
+        Path of the JSON file, it is overwritten if it exists.
+    """
+    with open(path, 'w', encoding='utf-8') as metricsFile:
+        json.dump(getMetrics(), metricsFile, indent=2, sort_keys=True)
+
+
+def _isNotFound(exc):
+    """Return True if an `APIError` was caused by a 404 reply."""
+    return exc.response is not None and exc.response.status_code == 404
+
+
+def configure(config):
+    """Set the module's global settings from the provisioning configuration.
+    
+    Parameters
+    ==========
+    config : `dict`
+        The contents of ``config.yaml``, as returned by `yamlUtility.loadConfig`.
+        Only the keys related to the API are used, missing keys keep their
+        current value.
+    
+    Notes
+    =====
+    The pool size only affects clients created after this function is called,
+    so it should be called before making any request. The circuit breaker and
+    the rate limiters are replaced by new ones with the configured settings.
+    
+    If the configuration contains the ``provisioningDir``, `idCache` is loaded
+    from ``.idCache.json`` inside it. The caller must call ``idCache.save()`` at
+    the end of the run to keep the ids for the next one.
+    """
+    global url, timeout, poolSize, retries, retryBackoff, retryBackoffMax, breakerThreshold, breakerReset
+    global readRate, readBurst, writeRate, writeBurst, pageSize
+    global _breaker, _readBucket, _writeBucket, idCache
+    url = config.get('grafanaUrl', url)
+    timeout = config.get('timeout', timeout)
+    poolSize = config.get('poolSize', poolSize)
+    retries = config.get('retries', retries)
+    retryBackoff = config.get('retryBackoff', retryBackoff)
+    retryBackoffMax = config.get('retryBackoffMax', retryBackoffMax)
+    breakerThreshold = config.get('breakerThreshold', breakerThreshold)
+    breakerReset = config.get('breakerReset', breakerReset)
+    _breaker = CircuitBreaker(breakerThreshold, breakerReset)
+    readRate = config.get('readRate', readRate)
+    readBurst = config.get('readBurst', readBurst)
+    writeRate = config.get('writeRate', writeRate)
+    writeBurst = config.get('writeBurst', writeBurst)
+    _readBucket = TokenBucket(readRate, readBurst)
+    _writeBucket = TokenBucket(writeRate, writeBurst)
+    pageSize = config.get('pageSize', pageSize)
+    if 'provisioningDir' in config:
+        idCache = IdCache('{}/.idCache.json'.format(config['provisioningDir']))
+
+
+def _apiUrl(api):
+    """Return the url needed to make an API request.
     
     Parameters
     ==========
     api : `str`
         Suffix of the url. This should be the variable part of the API path that is
         required in the url, i.e. what comes after ``[...]/api/``.
-    user : `str`
-        ``login`` of the Grafana account that is making the API request.
-    password : `str`
-        ``password`` of the Grafana account that is making the API request.
     
     Returns
     =======
     url : `str`
-        The complete url to be used for API requests, including the credentials for
-        basic authentication.
+        The complete url to be used for API requests. Credentials are not part of
+        the url, they are sent in the headers by `GrafanaClient`.
+    
+    Notes
+    =====
+    To use HTTPS you can change the global variable `url` at your own discretion,
+    because a valid certificate was not available at the time of development, so
+    this functionality has not been tested.
+    """
+    return '{}{}'.format(url, api)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Represents that a request was not sent because Grafana is not responding.
+    
+    This exception is raised instead of making a request while the circuit
+    breaker is open, which happens after too many consecutive calls to the API
+    failed because Grafana was unreachable or replied that it is unavailable.
+    """
+
+
+class CircuitBreaker:
+    """Keep track of consecutive failed calls to stop calling Grafana when down.
+    
+    The breaker is closed while Grafana is responding. After `threshold` calls in
+    a row fail it opens, and every call fails fast until `resetTimeout` seconds
+    have passed. Then one call is let through: if it succeeds the breaker closes,
+    and if it fails the breaker opens again.
+    
+    Parameters
+    ----------
+    threshold : `int`
+        Number of consecutive failed calls needed to open the breaker. If it's 0
+        the breaker never opens.
+    resetTimeout : `float`
+        Seconds during which calls fail fast after the breaker opens.
+    """
+    
+    def __init__(self, threshold, resetTimeout):
+        self.threshold = threshold
+        self.resetTimeout = resetTimeout
+        self.failures = 0
+        self.openedAt = None
+        self._lock = threading.Lock()
+    
+    def check(self):
+        """Make sure that a call can be made.
+        
+        Raises
+        ======
+        CircuitOpenError
+            Raised if the breaker is open and `resetTimeout` hasn't passed yet.
+        """
+        with self._lock:
+            if self.openedAt is None:
+                return
+            remaining = self.openedAt + self.resetTimeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError('Grafana\'s API failed {} calls in a row, no requests will be made for '
+                    'the next {:.0f} seconds.'.format(self.failures, remaining))
+            # Let one call through, if it fails the breaker opens again
+            self.openedAt = time.monotonic()
+    
+    def success(self):
+        """Register a call that reached Grafana and close the breaker."""
+        with self._lock:
+            self.failures = 0
+            self.openedAt = None
+    
+    def failure(self):
+        """Register a call that failed because Grafana was not responding."""
+        with self._lock:
+            self.failures += 1
+            if self.threshold and self.failures >= self.threshold:
+                self.openedAt = time.monotonic()
+
+
+class TokenBucket:
+    """Rate limiter that lets through `rate` calls per second on average.
+    
+    The bucket holds up to `burst` tokens and is refilled at `rate` tokens per
+    second. Every call takes one token, waiting for it if the bucket is empty.
+    This allows short bursts of calls while keeping the average rate limited.
+    
+    Parameters
+    ----------
+    rate : `float`
+        Tokens added to the bucket per second. If it's 0 calls are never limited.
+    burst : `int`
+        Maximum number of tokens in the bucket, the bucket starts full.
+    
+    Notes
+    =====
+    The bucket is shared by all threads, each of them waits for its own token
+    without holding the lock.
+    """
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updatedAt = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take a token from the bucket, waiting until there is one available."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updatedAt) * self.rate)
+            self.updatedAt = now
+            # The token is taken right away, going below 0 reserves a future one
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _retryDelay(attempt, response=None):
+    """Return how many seconds to wait before retrying a request.
+    
+    Parameters
+    ==========
+    attempt : `int`
+        Number of the attempt that just failed, starting at 0.
+    response : `requests.Response`, optional
+        Response of the failed attempt, if there was one. Its ``Retry-After``
+        header is used when present.
+    
+    Returns
+    =======
+    delay : `float`
+        Seconds to wait, never more than `retryBackoffMax`.
+    """
+    retryAfter = None if response is None else response.headers.get('Retry-After')
+    if retryAfter is not None:
+        try:
+            delay = float(retryAfter)
+        except ValueError:
+            # The header can also be an HTTP date
+            try:
+                date = email.utils.parsedate_to_datetime(retryAfter)
+                delay = date.timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), retryBackoffMax)
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(retryBackoffMax, retryBackoff * 2 ** attempt))
+
+
+def _connectFailed(exc):
+    """Return True if a request failed while connecting, before it was sent.
+    
+    Parameters
+    ==========
+    exc : `requests.ConnectionError` or `requests.Timeout`
+        Error raised by the request.
+    """
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps the error of urllib3, which has the original one as its reason
+    pending = [exc]
+    seen = set()
+    while pending:
+        error = pending.pop()
+        if error is None or id(error) in seen:
+            continue
+        seen.add(id(error))
+        if isinstance(error, NewConnectionError):
+            return True
+        pending += [getattr(error, 'reason', None), error.__cause__, error.__context__]
+        pending += [arg for arg in error.args if isinstance(arg, BaseException)]
+    return False
+
+
+class GrafanaClient:
+    """HTTP client that keeps a pool of open connections to Grafana's API.
+    
+    Every request made through the same client reuses the connections of its
+    `requests.Session`, instead of opening a new TCP connection each time. The
+    credentials are set once as an ``Authorization`` header for basic
+    authentication, so they are never part of a url.
+    
+    Parameters
+    ----------
+    user : `str`
+        ``login`` of the Grafana account that is making the API requests.
+    password : `str`
+        ``password`` of the Grafana account that is making the API requests.
+    maxConnections : `int`, optional
+        Maximum number of connections kept open by the client. Defaults to the
+        global variable `poolSize`.
     
     Notes
     =====
-    To use HTTPS you can change the string returned by this function at your own
-    discretion, because a valid certificate was not available at the time of
-    development, so this functionality has not been tested.
+    A client can be shared between threads, as long as its session is not
+    reconfigured while requests are being made.
     """
-    return 'http://{}:{}@localhost:3000/api/{}'.format(user, password, api)
+    
+    def __init__(self, user, password, maxConnections=None):
+        self.user = user
+        self.password = password
+        if maxConnections is None:
+            maxConnections = poolSize
+        
+        self.session = requests.Session()
+        # There is only one host, so a single pool holding all connections is enough
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxConnections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        credentials = base64.b64encode('{}:{}'.format(user, password).encode('utf-8')).decode('ascii')
+        self.session.headers.update(head)
+        self.session.headers['Authorization'] = 'Basic {}'.format(credentials)
+        # Whether Grafana has orgs/{id}/users/search, None until iterOrgMembers finds out
+        self.orgUsersSearch = None
+        self.probeLock = threading.Lock()
+    
+    def request(self, method, api, jsn=None):
+        """Make any kind of request to the Grafana API with this client's session.
+        
+        Parameters
+        ==========
+        method : {'get', 'post', 'put', 'delete', 'patch'} (`str`)
+            An HTTP request method as a lowercase string.
+        api : `str`
+            Suffix of the url. This should be the variable part of the API path that
+            is required in the url, i.e. what comes after ``http://[...]/api/``.
+        jsn : `dict`
+            Contains the metadata that will be passed in JSON format with the API
+            request. This should be data that Grafana is prepared to receive.
+            Optional.
+        
+        Returns
+        =======
+        response : `requests.Response`
+            Response object containig the data returned by Grafana.
+        
+        Raises
+        ======
+        APIError
+            Raised if the request replies with a status code in the 4XX or 5XX
+            range, after all the retries when the status code can be retried.
+        CircuitOpenError
+            Raised without making the request if Grafana has not been responding
+            for the last calls.
+        requests.ConnectionError
+            Raised if Grafana can't be reached after all the retries.
+        requests.Timeout
+            Raised if Grafana doesn't reply in time after all the retries.
+        
+        Notes
+        =====
+        Errors while connecting are retried for every method, since Grafana
+        refuses connections while it restarts. Other connection errors, read
+        timeouts and status codes are only retried for idempotent methods: a POST
+        whose connection was reset after it was sent could have been applied, and
+        sending it again would fail as a duplicate.
+        """
+        kwargs = {'timeout': timeout}
+        if jsn is not None:
+            kwargs['json'] = jsn
+        idempotent = method in idempotentMethods
+        breaker = _breaker
+        bucket = _readBucket if method == 'get' else _writeBucket
+        attempt = 0
+        while True:
+            breaker.check()
+            bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, _apiUrl(api), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                metrics.record(method, api, type(exc).__name__, time.perf_counter() - start)
+                canRetry = idempotent or _connectFailed(exc)
+                if attempt >= retries or not canRetry:
+                    breaker.failure()
+                    raise
+                time.sleep(_retryDelay(attempt))
+                attempt += 1
+                continue
+            sent = len(response.request.body or b'')
+            metrics.record(method, api, response.status_code, time.perf_counter() - start, sent,
+                len(response.content))
+            
+            if response.status_code in retryStatusCodes and attempt < retries and idempotent:
+                time.sleep(_retryDelay(attempt, response))
+                attempt += 1
+                continue
+            # Too many requests means that Grafana is still responding
+            if response.status_code in retryStatusCodes and response.status_code != 429:
+                breaker.failure()
+            else:
+                breaker.success()
+            break
+        
+        # We do not use response.raise_for_status() to keep the same error format
+        # for every request made by the provisioning scripts.
+        if 400 <= response.status_code <= 599:
+            raise APIError(self.user, self.password, response) from None
+        return response
+    
+    def close(self):
+        """Close all the connections kept open by the client."""
+        self.session.close()
+
+
+_breaker = CircuitBreaker(breakerThreshold, breakerReset)
+_readBucket = TokenBucket(readRate, readBurst)
+_writeBucket = TokenBucket(writeRate, writeBurst)
 
 
-def _req(requestFunction, api, user, password, jsn=None):
+def getClient(user, password):
+    """Return the default client for the given credentials, creating it if needed.
+    
+    Parameters
+    ==========
+    user : `str`
+        ``login`` of the Grafana account that is making the API requests.
+    password : `str`
+        ``password`` of the Grafana account that is making the API requests.
+    
+    Returns
+    =======
+    client : `GrafanaClient`
+        Client shared by all the module level functions that are called with the
+        same `user` and `password`.
+    """
+    key = (user, password)
+    with _clientsLock:
+        client = _clients.get(key)
+        if client is None:
+            client = GrafanaClient(user, password)
+            _clients[key] = client
+    return client
+
+
+def _req(method, api, user, password, jsn=None):
     """Make any kind of request to the Grafana API using basic authentication.
     
     Parameters
     ==========
-    requestFunction : `requests`.{`get`, `post`, `put`, `delete`, `patch`}
-        A requests function that can make an HTTP request with a certain method.
+    method : {'get', 'post', 'put', 'delete', 'patch'} (`str`)
+        An HTTP request method as a lowercase string.
     api : `str`
         Suffix of the url. This should be the variable part of the API path that is
         required in the url, i.e. what comes after ``http://[...]/api/``.
@@ -88,23 +765,15 @@ def _req(requestFunction, api, user, password, jsn=None):
     
     See Also
     ========
-    _apiUrl
+    getClient
+    GrafanaClient.request
     
     Notes
     =====
     Requests that return with a status code that represents an error are logged by
     Grafana to ``/var/log/messages``.
     """
-    url = _apiUrl(api, user, password)
-    if jsn is None:
-        response = requestFunction(url, headers=head, timeout=timeout)
-    else:
-        response = requestFunction(url, json=jsn, headers=head, timeout=timeout)
-    # We do not use response.raise_for_status() since it could print the url
-    # (with the user and password) to stdout/stderr.
-    if 400 <= response.status_code <= 599:
-        raise APIError(user, password, response) from None
-    return response
+    return getClient(user, password).request(method, api, jsn)
 
 
 class APIError(requests.RequestException):
@@ -210,7 +879,6 @@ def request(method, api, user, password, jsn=None):
     
     See Also
     ========
-    _apiUrl
     _req
     
     Notes
@@ -219,13 +887,13 @@ def request(method, api, user, password, jsn=None):
     with an HTTP method as string instead of as a library function. This way we
     separate implementation details from functionality.
     
-    The `methods` dictionary is defined globally so that it does not need to be
+    The `methods` tuple is defined globally so that it does not need to be
     created every time a request is made. It only contains the HTTP methods
     currently used by the scripts.
     """
     method = method.lower()
     if method in methods:
-        return _req(methods[method], api, user, password, jsn)
+        return _req(method, api, user, password, jsn)
     else:
         raise ValueError('The HTTP method requested does not exist or is not implemented.')
 
@@ -269,7 +937,7 @@ def removeFromOrg(orgId, userId, user, password):
     from the default organization, and when creating new organizations to remove
     the API account from them.
     """
-    return _req(requests.delete, 'orgs/{}/users/{}'.format(orgId, userId), user, password)
+    return _req('delete', 'orgs/{}/users/{}'.format(orgId, userId), user, password)
 
 
 def setUserRoleOrg(orgId, userId, login, newRole, user, password):
@@ -302,16 +970,23 @@ def setUserRoleOrg(orgId, userId, login, newRole, user, password):
     See Also
     ========
     _req
+    addOrgUser
+    updateOrgUserRole
+    getOrgMembers
     
     Notes
     =====
+    This function makes one request to find the user's current role. To review
+    many users of the same org, use `getOrgMembers` once and then `addOrgUser` or
+    `updateOrgUserRole` only for the users that need it.
+    
     In the future, if needed login can be turned into an optional parameter and it
     can be fetched inside this function using `userId`. Currently the function
     assumes that the `login` corresponds to the correct `userId` in Grafana.
     Passing a `login` of a different user might produce unexpected behavior.
     """
     # Get list of orgs for user
-    r = _req(requests.get, 'users/{}/orgs'.format(userId), user, password)
+    r = _req('get', 'users/{}/orgs'.format(userId), user, password)
     userOrgs = r.json()
     
     # Get the role for the user in the org if it exists
@@ -319,16 +994,318 @@ def setUserRoleOrg(orgId, userId, login, newRole, user, password):
     # If the account exists but it's not in the org, add them to the org with role
     newRole = newRole.capitalize()
     if currentRole is None:
-        data = {'loginOrEmail':login, 'role':newRole}
-        r = _req(requests.post, 'orgs/{}/users'.format(orgId), user, password, data)
-        
-        # Change context organization for user
-        r = _req(requests.post, 'users/{}/using/{}'.format(userId, orgId), user, password)
-        
+        addOrgUser(orgId, userId, login, newRole, user, password)
     # If the user belongs to the org but the role has changed
     elif currentRole != newRole:
-        data = {'role':newRole}
-        r = _req(requests.patch, 'orgs/{}/users/{}'.format(orgId, userId), user, password, data)
+        updateOrgUserRole(orgId, userId, newRole, user, password)
+
+
+def _iterPages(api, key, user, password, perPage=None):
+    """Yield the items of a paginated search, requesting one page at a time.
+    
+    Parameters
+    ==========
+    api : `str`
+        Search endpoint of the API, without query string (e.g. ``users/search``).
+    key : `str` or `None`
+        Key of the reply that holds the list of items, or None if the reply is the
+        list itself.
+    user : `str`
+        ``login`` of the Grafana account that is making the API requests.
+    password : `str`
+        ``password`` of the Grafana account that is making the API requests.
+    perPage : `int`, optional
+        Number of items requested on each page. Defaults to `pageSize`.
+    
+    Yields
+    ======
+    item : `dict`
+        Each item of the search, as replied by Grafana.
+    
+    Raises
+    ======
+    APIError
+        Raised if a request replies with a status code in the 4XX or 5XX range.
+    
+    Notes
+    =====
+    The last page is the one that isn't full, or the one that reaches the
+    ``totalCount`` of the reply when Grafana sends it.
+    
+    Grafana 5.4 ignores ``perpage`` and ``page`` in ``orgs``, whose reply has no
+    ``totalCount``, and always replies with up to 1000 orgs. A page with more
+    than `perPage` items, or that starts with the same item as the previous one,
+    means that the server is not paginating, so the search ends there.
+    """
+    if perPage is None:
+        perPage = pageSize
+    page = 1
+    first = None
+    while True:
+        r = _req('get', '{}?perpage={}&page={}'.format(api, perPage, page), user, password)
+        result = r.json()
+        items = result if key is None else result[key]
+        if page > 1 and items and items[0] == first:
+            return
+        for item in items:
+            yield item
+        total = None if key is None else result.get('totalCount')
+        if len(items) != perPage or (total is not None and page * perPage >= total):
+            return
+        first = items[0]
+        page += 1
+
+
+def iterUsers(user, password, perPage=None):
+    """Iterate over every Grafana user, loading them one page at a time.
+    
+    Parameters
+    ==========
+    user : `str`
+        ``login`` of the Grafana account that is making the API requests.
+    password : `str`
+        ``password`` of the Grafana account that is making the API requests.
+    perPage : `int`, optional
+        Number of users requested on each page. Defaults to `pageSize`.
+    
+    Yields
+    ======
+    account : `dict`
+        Data of each user, as replied by ``users/search``. It includes the user's
+        ``id`` and ``login``.
+    
+    Raises
+    ======
+    APIError
+        Raised if a request replies with a status code in the 4XX or 5XX range.
+        The causes include: invalid credentials (`user` and `password`), the user
+        doesn't have permission to make this request or the server is not
+        responding. Check the error messages for more information.
+    
+    See Also
+    ========
+    _iterPages
+    """
+    return _iterPages('users/search', 'users', user, password, perPage)
+
+
+def iterOrgs(user, password, perPage=None):
+    """Iterate over every Grafana organization, loading them one page at a time.
+    
+    Parameters
+    ==========
+    user : `str`
+        ``login`` of the Grafana account that is making the API requests.
+    password : `str`
+        ``password`` of the Grafana account that is making the API requests.
+    perPage : `int`, optional
+        Number of orgs requested on each page. Defaults to `pageSize`.
+    
+    Yields
+    ======
+    org : `dict`
+        Data of each org, as replied by ``orgs``. It includes the org's ``id``
+        and ``name``.
+    
+    Raises
+    ======
+    APIError
+        Raised if a request replies with a status code in the 4XX or 5XX range.
+        The causes include: invalid credentials (`user` and `password`), the user
+        doesn't have permission to make this request or the server is not
+        responding. Check the error messages for more information.
+    
+    See Also
+    ========
+    _iterPages
+    """
+    return _iterPages('orgs', None, user, password, perPage)
+
+
+def iterOrgMembers(orgId, user, password, perPage=None):
+    """Iterate over the members of a Grafana organization, one page at a time.
+    
+    Parameters
+    ==========
+    orgId : `int`
+        Number corresponding to the organization's ``id`` in Grafana.
+    user : `str`
+        ``login`` of the Grafana account that is making the API requests.
+    password : `str`
+        ``password`` of the Grafana account that is making the API requests.
+    perPage : `int`, optional
+        Number of members requested on each page. Defaults to `pageSize`.
+    
+    Yields
+    ======
+    member : `dict`
+        Data of each member, as replied by Grafana. It includes the user's
+        ``userId``, ``login`` and ``role``.
+    
+    Raises
+    ======
+    APIError
+        Raised if a request replies with a status code in the 4XX or 5XX range.
+        The causes include: inexistant organization, invalid credentials (`user`
+        and `password`), the user doesn't have permission to make this request or
+        the server is not responding. Check the error messages for more
+        information.
+    
+    Notes
+    =====
+    Versions of Grafana without the paginated ``orgs/{id}/users/search`` endpoint,
+    like 5.4, reply to it with a 404, in which case every member is loaded at once
+    from ``orgs/{id}/users``. The client of `user` remembers it, and the next orgs
+    are loaded from ``orgs/{id}/users`` directly.
+    """
+    client = getClient(user, password)
+    members = None
+    if client.orgUsersSearch is None:
+        # Only one thread asks for the endpoint until it's known whether it exists
+        with client.probeLock:
+            if client.orgUsersSearch is None:
+                try:
+                    pages = _iterPages('orgs/{}/users/search'.format(orgId), 'orgUsers', user, password,
+                        perPage)
+                    # Nothing has been yielded if the first page fails
+                    first = next(pages, None)
+                    members = itertools.chain([] if first is None else [first], pages)
+                    client.orgUsersSearch = True
+                except APIError as exc:
+                    if not _isNotFound(exc):
+                        raise exc
+                    members = _req('get', 'orgs/{}/users'.format(orgId), user, password).json()
+                    # Only remembered if the org exists, else the 404 was because of the org
+                    client.orgUsersSearch = False
+    if members is None:
+        if client.orgUsersSearch:
+            members = _iterPages('orgs/{}/users/search'.format(orgId), 'orgUsers', user, password, perPage)
+        else:
+            members = _req('get', 'orgs/{}/users'.format(orgId), user, password).json()
+    yield from members
+
+
+def getOrgMembers(orgId, user, password):
+    """Obtain the role of every user that belongs to a Grafana organization.
+    
+    Parameters
+    ==========
+    orgId : `int`
+        Number corresponding to the organization's ``id`` in Grafana.
+    user : `str`
+        ``login`` of the Grafana account that is making the API request.
+    password : `str`
+        ``password`` of the Grafana account that is making the API request.
+    
+    Returns
+    =======
+    members : `dict`
+        Dictionary with one key per user in the org, where the key is the user's
+        ``login`` and the value is a `tuple` with the user's ``id`` and role.
+    
+    Raises
+    ======
+    APIError
+        Raised if the request replies with a status code in the 4XX or 5XX range.
+        The causes include: inexistant organization, invalid credentials (`user`
+        and `password`), the user doesn't have permission to make this request or
+        the server is not responding. Check the error messages for more
+        information.
+    
+    See Also
+    ========
+    iterOrgMembers
+    """
+    return {m['login']: (m['userId'], m['role']) for m in iterOrgMembers(orgId, user, password)}
+
+
+def addOrgUser(orgId, userId, login, role, user, password):
+    """Add a user that doesn't belong to an org to it, with a role.
+    
+    Parameters
+    ==========
+    orgId : `int`
+        Number corresponding to the organization's ``id`` in Grafana.
+    userId : `int`
+        ``id`` of the user who is being added to the Grafana org.
+    login : `str`
+        Grafana username (``login``) of the user who is being added.
+    role : {'Admin', 'Editor', 'Viewer'}
+        The role to be assigned to the user inside the organization.
+    user : `str`
+        ``login`` of the Grafana account that is making the API request.
+    password : `str`
+        ``password`` of the Grafana account that is making the API request.
+    
+    Raises
+    ======
+    APIError
+        Raised if the request replies with a status code in the 4XX or 5XX range.
+        The causes include: the user already belongs to the org, invalid `role`,
+        inexistant organization or user, invalid credentials (`user` and
+        `password`), the user doesn't have permission to make this request or the
+        server is not responding. Check the error messages for more information.
+    
+    See Also
+    ========
+    _req
+    
+    Notes
+    =====
+    The new org is also set as the current context organization of the user. If
+    the `userId` came from `idCache` and Grafana doesn't find it, the entry is
+    evicted and the ``id`` is looked up again.
+    """
+    data = {'loginOrEmail':login, 'role':role.capitalize()}
+    try:
+        r = _req('post', 'orgs/{}/users'.format(orgId), user, password, data)
+    except APIError as exc:
+        # The user doesn't exist anymore, it will be created again on the next run
+        if _isNotFound(exc):
+            idCache.evict('users', login)
+        raise
+    
+    # Change context organization for user
+    try:
+        r = _req('post', 'users/{}/using/{}'.format(userId, orgId), user, password)
+    except APIError as exc:
+        if not _isNotFound(exc) or not idCache.evict('users', login, userId):
+            raise
+        userId = getExistingUserId(login, user, password)
+        r = _req('post', 'users/{}/using/{}'.format(userId, orgId), user, password)
+
+
+def updateOrgUserRole(orgId, userId, role, user, password):
+    """Change the role of a user that already belongs to an org.
+    
+    Parameters
+    ==========
+    orgId : `int`
+        Number corresponding to the organization's ``id`` in Grafana.
+    userId : `int`
+        ``id`` of the user whose role is being changed.
+    role : {'Admin', 'Editor', 'Viewer'}
+        The new role of the user inside the organization.
+    user : `str`
+        ``login`` of the Grafana account that is making the API request.
+    password : `str`
+        ``password`` of the Grafana account that is making the API request.
+    
+    Raises
+    ======
+    APIError
+        Raised if the request replies with a status code in the 4XX or 5XX range.
+        The causes include: the user doesn't belong to the org, invalid `role`,
+        invalid credentials (`user` and `password`), the user doesn't have
+        permission to make this request or the server is not responding. Check
+        the error messages for more information.
+    
+    See Also
+    ========
+    _req
+    """
+    data = {'role':role.capitalize()}
+    r = _req('patch', 'orgs/{}/users/{}'.format(orgId, userId), user, password, data)
 
 
 def createAccount(accountData, user, password):
@@ -368,13 +1345,14 @@ def createAccount(accountData, user, password):
     removeFromOrg
     """
     try:
-        r1 = _req(requests.post, 'admin/users', user, password, accountData)
+        r1 = _req('post', 'admin/users', user, password, accountData)
     except APIError as exc:
         print('Failed to create user account: {}'.format(accountData['login']))
         raise exc
     
     # Remove user from default org
     userId = r1.json()['id']
+    idCache.set('users', accountData['login'], userId)
     removeFromOrg(1, userId, user, password)
     
     return userId
@@ -418,7 +1396,7 @@ def createGrafanaAdmin(accountData, user, password):
     """
     userId = createAccount(accountData, user, password)
     data = {'isGrafanaAdmin': True}
-    r = _req(requests.put, 'admin/users/{}/permissions'.format(userId), user, password, data)
+    r = _req('put', 'admin/users/{}/permissions'.format(userId), user, password, data)
 
 
 def getExistingUserId(login, user, password):
@@ -454,22 +1432,33 @@ def getExistingUserId(login, user, password):
     =====
     If the user doesn't exist and there is another user with an email that is equal
     to this user's login name, that user will be retrieved instead.
+    
+    The ``id`` is taken from `idCache` when it's there, without making a request.
     """
-    r = _req(requests.get, 'users/lookup?loginOrEmail={}'.format(login), user, password)
-    return r.json()['id']
+    userId = idCache.get('users', login)
+    if userId is None:
+        r = _req('get', 'users/lookup?loginOrEmail={}'.format(login), user, password)
+        userId = r.json()['id']
+        idCache.set('users', login, userId)
+    return userId
 
 
-def createOrg(orgName, mainAdmin, user, password):
+def createOrg(orgName, mainAdmin, user, password, apiUserId=None):
     """Create a new Grafana organization.
     
     Parameters
     ==========
     orgName : `str`
         Name of the Grafana organization to be created.
+    mainAdmin : `str`
+        Username of Grafana's Main admin, who is added to the org as Admin.
     user : `str`
         ``login`` of the Grafana account that is making the API request.
     password : `str`
         ``password`` of the Grafana account that is making the API request.
+    apiUserId : `int`, optional
+        ``id`` of the account making the request, which is removed from the org.
+        If not given, it's looked up by `user`.
     
     Returns
     =======
@@ -494,15 +1483,22 @@ def createOrg(orgName, mainAdmin, user, password):
     """
     # Create the org and get the ID
     data = {'name':orgName}
-    r = _req(requests.post, 'orgs', user, password, data)
+    r = _req('post', 'orgs', user, password, data)
     orgId = r.json()['orgId']
+    idCache.set('orgs', orgName, orgId)
     
     # Add main admin to org
     setUserRoleOrg(orgId, 1, mainAdmin, 'Admin', user, password)
     
     # Remove API user from org
-    apiId = getExistingUserId(user, user, password)
-    removeFromOrg(orgId, apiId, user, password)
+    apiId = apiUserId if apiUserId is not None else getExistingUserId(user, user, password)
+    try:
+        removeFromOrg(orgId, apiId, user, password)
+    except APIError as exc:
+        if not _isNotFound(exc) or not idCache.evict('users', user, apiId):
+            raise
+        apiId = getExistingUserId(user, user, password)
+        removeFromOrg(orgId, apiId, user, password)
     
     return orgId
 
@@ -536,7 +1532,121 @@ def getOrgId(orgName, user, password):
     See Also
     ========
     _req
+    
+    Notes
+    =====
+    The ``id`` is taken from `idCache` when it's there, without making a request.
     """
-    r = _req(requests.get, 'orgs/name/{}'.format(orgName), user, password)
-    orgId = r.json()['id']
+    orgId = idCache.get('orgs', orgName)
+    if orgId is None:
+        r = _req('get', 'orgs/name/{}'.format(orgName), user, password)
+        orgId = r.json()['id']
+        idCache.set('orgs', orgName, orgId)
     return orgId
+
+
+def getOrgIds(user, password):
+    """Obtain the ``id`` of every Grafana organization with one request per page.
+    
+    Parameters
+    ==========
+    user : `str`
+        ``login`` of the Grafana account that is making the API request.
+    password : `str`
+        ``password`` of the Grafana account that is making the API request.
+    
+    Returns
+    =======
+    orgIds : `dict`
+        Dictionary with one key per organization in Grafana, where the key is the
+        org's name and the value is its ``id``.
+    
+    Raises
+    ======
+    APIError
+        Raised if the request replies with a status code in the 4XX or 5XX range.
+        The causes include: invalid credentials (`user` and `password`), the user
+        doesn't have permission to make this request or the server is not
+        responding. Check the error messages for more information.
+    
+    See Also
+    ========
+    iterOrgs
+    getOrgId
+    
+    Notes
+    =====
+    The ids are also stored in `idCache`, replacing the ones that changed.
+    """
+    orgIds = {}
+    for org in iterOrgs(user, password):
+        orgIds[org['name']] = org['id']
+        idCache.set('orgs', org['name'], org['id'])
+    return orgIds
+
+
+class UserIndex:
+    """Index of every Grafana user's ``id`` by their ``login``.
+    
+    All the users are loaded when the index is created with `iterUsers`, so that
+    looking up many users takes one request per page instead of one request per
+    user. Only the ``login`` and ``id`` of each user are kept.
+    
+    Parameters
+    ----------
+    user : `str`
+        ``login`` of the Grafana account that is making the API requests.
+    password : `str`
+        ``password`` of the Grafana account that is making the API requests.
+    perPage : `int`, optional
+        Number of users requested on each page. Defaults to `pageSize`.
+    
+    Raises
+    ------
+    APIError
+        Raised if a request replies with a status code in the 4XX or 5XX range.
+        The causes include: invalid credentials (`user` and `password`), the user
+        doesn't have permission to make this request or the server is not
+        responding. Check the error messages for more information.
+    
+    Notes
+    =====
+    The index is not updated with changes made to Grafana after it's loaded,
+    except for the users added to it with `add`.
+    """
+    
+    def __init__(self, user, password, perPage=None):
+        self.ids = {u['login']: u['id'] for u in iterUsers(user, password, perPage)}
+    
+    def __contains__(self, login):
+        return login in self.ids
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def get(self, login):
+        """Return the ``id`` of the user with the given ``login``.
+        
+        Parameters
+        ==========
+        login : `str`
+            Grafana username (``login``) of the user.
+        
+        Returns
+        =======
+        userId : `int` or `None`
+            Grafana ``id`` of the user, or None if the user doesn't exist.
+        """
+        return self.ids.get(login)
+    
+    def add(self, login, userId):
+        """Add a user that was created after loading the index.
+        
+        Parameters
+        ==========
+        login : `str`
+            Grafana username (``login``) of the user.
+        userId : `int`
+            Grafana ``id`` of the user.
+        """
+        self.ids[login] = userId
@@ -0,0 +1,182 @@
+"""Module to make concurrent requests to Grafana's API with asyncio.
+
+This module offers the same functions as `grafanaAPI` as coroutines, so that
+independent requests can be sent to Grafana at the same time instead of waiting
+for each round trip.
+
+The requests themselves are still made by the pooled `grafanaAPI.GrafanaClient`
+on a pool of worker threads, so retries, timeouts and error handling are the
+same for both modules. The number of threads is the number of requests in
+flight, which by default is the number of connections kept open by the client,
+so the connections are always reused. Any number of coroutines can be awaited
+at once: their requests wait for a free thread in the order they were made.
+
+Examples
+========
+Scripts that are not asynchronous can use the sync facade of `AsyncGrafana`::
+
+    agapi = AsyncGrafana(user, password)
+    userIds = agapi.runAll([agapi.createAccount(a) for a in accounts])
+    agapi.close()
+
+Functions
+=========
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import grafanaAPI as gapi
+
+
+class AsyncGrafana:
+    """Asynchronous version of the `grafanaAPI` functions for a Grafana account.
+    
+    Every coroutine of this class corresponds to the function with the same name
+    in `grafanaAPI`, without the `user` and `password` parameters, which are
+    given once when creating the object.
+    
+    Parameters
+    ----------
+    user : `str`
+        ``login`` of the Grafana account that is making the API requests.
+    password : `str`
+        ``password`` of the Grafana account that is making the API requests.
+    maxConcurrent : `int`, optional
+        Maximum number of requests that can be in flight at the same time, which
+        is the number of worker threads. Defaults to `grafanaAPI.poolSize`, so that
+        there is an open connection for every request.
+    
+    Notes
+    =====
+    The event loop used by the sync facade (`run` and `runAll`) is owned by the
+    object. The coroutines can also be awaited from any other event loop.
+    """
+    
+    def __init__(self, user, password, maxConcurrent=None):
+        self.user = user
+        self.password = password
+        if maxConcurrent is None:
+            maxConcurrent = gapi.poolSize
+        self.maxConcurrent = maxConcurrent
+        self.executor = ThreadPoolExecutor(max_workers=maxConcurrent)
+        self.loop = asyncio.new_event_loop()
+    
+    async def _call(self, function, *args):
+        """Run a blocking `grafanaAPI` function without blocking the event loop.
+        
+        Parameters
+        ==========
+        function : `callable`
+            Function of `grafanaAPI` to be called, its last two parameters must be
+            `user` and `password`.
+        *args
+            Rest of the parameters of `function`, in order.
+        
+        Returns
+        =======
+        result
+            Whatever `function` returns.
+        """
+        call = functools.partial(function, *args, self.user, self.password)
+        return await asyncio.get_event_loop().run_in_executor(self.executor, call)
+    
+    async def request(self, method, api, jsn=None):
+        """Coroutine version of `grafanaAPI.request`."""
+        # request receives the json data after the credentials
+        call = functools.partial(gapi.request, method, api, jsn=jsn)
+        return await self._call(call)
+    
+    async def removeFromOrg(self, orgId, userId):
+        """Coroutine version of `grafanaAPI.removeFromOrg`."""
+        return await self._call(gapi.removeFromOrg, orgId, userId)
+    
+    async def setUserRoleOrg(self, orgId, userId, login, newRole):
+        """Coroutine version of `grafanaAPI.setUserRoleOrg`."""
+        return await self._call(gapi.setUserRoleOrg, orgId, userId, login, newRole)
+    
+    async def getOrgMembers(self, orgId):
+        """Coroutine version of `grafanaAPI.getOrgMembers`."""
+        return await self._call(gapi.getOrgMembers, orgId)
+    
+    async def addOrgUser(self, orgId, userId, login, role):
+        """Coroutine version of `grafanaAPI.addOrgUser`."""
+        return await self._call(gapi.addOrgUser, orgId, userId, login, role)
+    
+    async def updateOrgUserRole(self, orgId, userId, role):
+        """Coroutine version of `grafanaAPI.updateOrgUserRole`."""
+        return await self._call(gapi.updateOrgUserRole, orgId, userId, role)
+    
+    async def createAccount(self, accountData):
+        """Coroutine version of `grafanaAPI.createAccount`."""
+        return await self._call(gapi.createAccount, accountData)
+    
+    async def getExistingUserId(self, login):
+        """Coroutine version of `grafanaAPI.getExistingUserId`."""
+        return await self._call(gapi.getExistingUserId, login)
+    
+    async def createOrg(self, orgName, mainAdmin, apiUserId=None):
+        """Coroutine version of `grafanaAPI.createOrg`."""
+        call = functools.partial(gapi.createOrg, apiUserId=apiUserId)
+        return await self._call(call, orgName, mainAdmin)
+    
+    async def getOrgId(self, orgName):
+        """Coroutine version of `grafanaAPI.getOrgId`."""
+        return await self._call(gapi.getOrgId, orgName)
+    
+    def run(self, coroutine):
+        """Run a coroutine until it completes and return its result.
+        
+        This is the sync facade of the class, which lets scripts that are not
+        asynchronous use it one caller at a time.
+        
+        Parameters
+        ==========
+        coroutine : `coroutine`
+            Usually one of the coroutines of this class, or a coroutine that awaits
+            them.
+        
+        Returns
+        =======
+        result
+            Whatever `coroutine` returns.
+        """
+        return self.loop.run_until_complete(coroutine)
+    
+    def runAll(self, coroutines, returnExceptions=False):
+        """Run coroutines concurrently and return their results in the same order.
+        
+        Parameters
+        ==========
+        coroutines : iterable of `coroutine`
+            Independent coroutines to be run at the same time. At most
+            `maxConcurrent` requests will be in flight at once.
+        returnExceptions : `bool`, optional
+            If True, the exceptions raised by the coroutines are returned in the
+            list of results instead of being raised. This way one failed request
+            doesn't hide the results of the others. Defaults to False.
+        
+        Returns
+        =======
+        results : `list`
+            The result of each coroutine, in the same order that they were given.
+        
+        Raises
+        ======
+        grafanaAPI.APIError
+            Raised if one of the requests fails and `returnExceptions` is False. The
+            rest of the coroutines still run until they complete.
+        """
+        async def gatherAll():
+            return await asyncio.gather(*coroutines, return_exceptions=True)
+        
+        results = self.run(gatherAll())
+        if not returnExceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+    
+    def close(self):
+        """Stop the worker threads and close the event loop."""
+        self.executor.shutdown()
+        self.loop.close()
@@ -0,0 +1,270 @@
+"""Module to wait for changes in the inputs of the provisioning scripts.
+
+``gpInputs.py --watch`` runs as a daemon that provisions the inputs as soon as
+they change, instead of on every Puppet execution. A watcher reports the paths
+of the files and directories that were created, modified or deleted under a
+directory, skipping hidden ones (like the ``.state.yaml`` written by the scripts).
+
+`InotifyWatcher` is notified by the Linux kernel through inotify, which it uses
+from the C library with ctypes, so no extra library is needed. Where inotify is
+not available, `PollingWatcher` compares the size and modification time of every
+file periodically. `createWatcher` returns the best one available, and
+`waitForChanges` groups the changes that come in a burst, like the files of a
+``git pull``.
+
+Examples
+========
+::
+
+    watcher = createWatcher('inputs')
+    while True:
+        paths = waitForChanges(watcher, 2)
+
+Functions
+=========
+"""
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# Events and flags of inotify, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+_eventHeader = struct.Struct('iIII')
+
+
+def _isHidden(top, path):
+    """Return True if any component of `path` below `top` starts with a period."""
+    relative = os.path.relpath(path, top)
+    return relative != '.' and any(part.startswith('.') for part in relative.split(os.sep))
+
+
+class InotifyWatcher:
+    """Watcher of a directory tree notified by inotify.
+    
+    Every directory of the tree is watched, including the ones created after the
+    watcher, which are watched as soon as their creation is read.
+    
+    Parameters
+    ----------
+    top : `str`
+        Path of the directory to watch.
+    
+    Raises
+    ------
+    OSError
+        Raised if inotify is not available, or the directories can't be watched,
+        for example because of the limit ``fs.inotify.max_user_watches``.
+    AttributeError
+        Raised if the C library doesn't have inotify.
+    """
+    
+    # Changes to the content of the tree, a file that is being written is only
+    # reported once it is closed
+    _mask = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+        | IN_MOVE_SELF)
+    
+    def __init__(self, top):
+        self.top = top
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        # Path of the directory of every watch descriptor
+        self.dirs = {}
+        try:
+            self._watchTree(top)
+        except BaseException:
+            self.close()
+            raise
+    
+    def _watchTree(self, top):
+        """Watch `top` and every directory inside it, except hidden ones."""
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), self._mask)
+            if wd < 0:
+                code = ctypes.get_errno()
+                # It was deleted before it could be watched
+                if code == errno.ENOENT:
+                    continue
+                raise OSError(code, os.strerror(code), dirpath)
+            self.dirs[wd] = dirpath
+    
+    def read(self, timeout=None):
+        """Return the paths that changed, waiting for a change up to `timeout`.
+        
+        Parameters
+        ==========
+        timeout : `float`, optional
+            Maximum number of seconds to wait. Defaults to None, which waits until
+            something changes.
+        
+        Returns
+        =======
+        paths : `set` of `str`
+            Paths of the files and directories that changed, empty if nothing
+            changed in `timeout`. If the kernel dropped events because too many
+            happened at once, it contains `top`, since anything could have changed.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self._fd, 1 << 16)
+        paths = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _eventHeader.unpack_from(data, offset)
+            name = data[offset + _eventHeader.size:offset + _eventHeader.size + length].rstrip(b'\0')
+            offset += _eventHeader.size + length
+            
+            if mask & IN_Q_OVERFLOW:
+                paths.add(self.top)
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            dirpath = self.dirs.get(wd)
+            if dirpath is None:
+                continue
+            path = os.path.join(dirpath, os.fsdecode(name)) if name else dirpath
+            if _isHidden(self.top, path):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watchTree(path)
+            paths.add(path)
+        return paths
+    
+    def close(self):
+        """Stop watching the tree."""
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Watcher of a directory tree that scans it periodically.
+    
+    Files are compared by size and modification time. Directories are only
+    reported when they are created or deleted, the files added to them are
+    reported by themselves.
+    
+    Parameters
+    ----------
+    top : `str`
+        Path of the directory to watch.
+    interval : `float`, optional
+        Seconds between two scans of the tree. Defaults to 5.
+    """
+    
+    def __init__(self, top, interval=5):
+        self.top = top
+        self.interval = interval
+        self._snapshot = self._scan()
+    
+    def _scan(self):
+        """Return the stat of every file and directory of the tree, except hidden ones."""
+        snapshot = {}
+        for dirpath, dirnames, filenames in os.walk(self.top):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            snapshot[dirpath] = None
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+    
+    def read(self, timeout=None):
+        """Return the paths that changed, waiting for a change up to `timeout`.
+        
+        Parameters
+        ==========
+        timeout : `float`, optional
+            Maximum number of seconds to wait. Defaults to None, which waits until
+            something changes.
+        
+        Returns
+        =======
+        paths : `set` of `str`
+            Paths of the files and directories that changed, empty if nothing
+            changed in `timeout`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if wait > 0:
+                time.sleep(wait)
+            snapshot = self._scan()
+            paths = {path for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path, 0) != self._snapshot.get(path, 0)}
+            self._snapshot = snapshot
+            if paths or (deadline is not None and time.monotonic() >= deadline):
+                return paths
+    
+    def close(self):
+        """Stop watching the tree."""
+        self._snapshot = {}
+
+
+def createWatcher(top, interval=5):
+    """Return an `InotifyWatcher` of `top`, or a `PollingWatcher` if it fails.
+    
+    Parameters
+    ==========
+    top : `str`
+        Path of the directory to watch.
+    interval : `float`, optional
+        Seconds between two scans of the `PollingWatcher`. Defaults to 5.
+    """
+    try:
+        return InotifyWatcher(top)
+    except (OSError, AttributeError) as exc:
+        print('Warning: inotify is not available ({}), {} will be scanned every {} seconds.'
+            .format(exc, top, interval))
+        return PollingWatcher(top, interval)
+
+
+def waitForChanges(watcher, debounce=2):
+    """Wait until something changes, and return everything that changed in the burst.
+    
+    Blocks until `watcher` reports a change, and then keeps reading changes until
+    `debounce` seconds pass without any.
+    
+    Parameters
+    ==========
+    watcher : `InotifyWatcher` or `PollingWatcher`
+        Watcher of the directory tree.
+    debounce : `float`, optional
+        Seconds without changes that end a burst. Defaults to 2.
+    
+    Returns
+    =======
+    paths : `set` of `str`
+        Paths of the files and directories that changed.
+    """
+    paths = set()
+    while not paths:
+        paths = watcher.read()
+    while True:
+        more = watcher.read(debounce)
+        if not more:
+            return paths
+        paths |= more
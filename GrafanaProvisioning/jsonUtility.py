@@ -0,0 +1,255 @@
+"""Module to read and write JSON with the fastest library that is installed.
+
+The dashboards copied by the provisioning scripts are parsed and written again
+on every change, and Grafana reads them back on every scan. This module offers
+the same two operations on top of orjson or ujson when one of them is installed,
+falling back to the standard library's json otherwise. The name of the library
+in use is stored in the global variable `backend`.
+
+Data is always read from and written as UTF-8 `bytes`, which is what orjson
+works with and what avoids decoding files twice.
+
+`stripMembers` removes members from the top level object of a JSON document
+working on its bytes, validating the document without parsing it into Python
+objects.
+
+Notes
+=====
+The libraries don't produce exactly the same bytes (e.g. the standard library
+escapes non ASCII characters), but the JSON they produce is equivalent.
+
+Functions
+=========
+"""
+import re
+import json
+
+try:
+    import orjson
+    backend = 'orjson'
+except ImportError:
+    try:
+        import ujson
+        backend = 'ujson'
+    except ImportError:
+        backend = 'json'
+
+# Every library raises a subclass of ValueError for invalid JSON, including the
+# standard library's json.JSONDecodeError
+DecodeError = ValueError
+
+# Grammar of JSON (RFC 8259), for stripMembers
+_ws = rb'[ \t\n\r]*'
+_stringPattern = rb'"[^"\\\x00-\x1f]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*)*"'
+_scalarPattern = (rb'(?:' + _stringPattern + rb'|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?'
+    rb'|true|false|null)')
+_whitespace = re.compile(_ws)
+_open = re.compile(_ws + rb'\{')
+# Empty array or object, right after its opening bracket
+_empty = re.compile(_ws + rb'([\]}])')
+# What follows a value: the comma before the next one, or the closing bracket
+_next = re.compile(_ws + rb'([,\]}])')
+# The scalar values of an array up to its closing bracket or its next nested value
+_arrayRun = re.compile(_ws + rb'(?:' + _scalarPattern + _ws + rb',' + _ws + rb')*(?:' + _scalarPattern
+    + _ws + rb'(\])|([\[{]))')
+# The same for the members of an object
+_objectRun = re.compile(_ws + rb'(?:' + _stringPattern + _ws + rb':' + _ws + _scalarPattern + _ws + rb','
+    + _ws + rb')*' + _stringPattern + _ws + rb':' + _ws + rb'(?:' + _scalarPattern + _ws + rb'(\})|([\[{]))')
+# A member of the top level object, with the key and either a scalar value or a bracket
+_member = re.compile(_ws + rb'(' + _stringPattern + rb')' + _ws + rb':' + _ws + rb'(?:(' + _scalarPattern
+    + rb')|([\[{]))')
+_closing = {b'[': b']', b'{': b'}'}
+
+def loads(data, library=None):
+    """Parse JSON data into a Python data structure.
+    
+    Parameters
+    ==========
+    data : `bytes`
+        UTF-8 encoded JSON document.
+    library : {'orjson', 'ujson', 'json'}, optional
+        Library used to parse `data`. Defaults to `backend`.
+    
+    Returns
+    =======
+    content : Usually `dict` or `list`
+        Contents of the JSON document translated to Python.
+    
+    Raises
+    ======
+    ValueError
+        Raised if `data` does not contain a valid JSON format or it isn't UTF-8.
+    """
+    library = library or backend
+    if library == 'orjson':
+        return orjson.loads(data)
+    if library == 'ujson':
+        return ujson.loads(data.decode('utf-8'))
+    return json.loads(data.decode('utf-8'))
+
+
+def _skipValue(data, position, bracket):
+    """Validate an array or object, and return the position where it ends.
+    
+    Parameters
+    ==========
+    data : `bytes`
+        UTF-8 encoded JSON document.
+    position : `int`
+        Position right after the bracket that opens the value.
+    bracket : `bytes`
+        The opening bracket, ``[`` or ``{``.
+    
+    Raises
+    ======
+    ValueError
+        Raised if the value is not valid JSON.
+    """
+    stack = [bracket]
+    state = 'open'
+    while stack:
+        if state == 'open':
+            match = _empty.match(data, position)
+            if match is None:
+                state = 'item'
+                continue
+            if match.group(1) != _closing[stack.pop()]:
+                raise ValueError('Unbalanced brackets at byte {}'.format(match.start(1)))
+            state = 'next'
+        elif state == 'item':
+            run = _arrayRun if stack[-1] == b'[' else _objectRun
+            match = run.match(data, position)
+            if match is None:
+                raise ValueError('Invalid JSON at byte {}'.format(position))
+            if match.group(2):
+                stack.append(match.group(2))
+                state = 'open'
+            else:
+                stack.pop()
+                state = 'next'
+        else:
+            match = _next.match(data, position)
+            if match is None:
+                raise ValueError('Invalid JSON at byte {}'.format(position))
+            if match.group(1) == b',':
+                state = 'item'
+            elif match.group(1) != _closing[stack.pop()]:
+                raise ValueError('Unbalanced brackets at byte {}'.format(match.start(1)))
+        position = match.end()
+    return position
+
+
+def stripMembers(data, names):
+    """Remove members from the top level object of a JSON document.
+    
+    The document is tokenized and validated without building its Python objects,
+    and every byte outside of the removed members is copied unchanged, so the
+    formatting is kept. Members with the same names in nested objects are not
+    removed.
+    
+    Parameters
+    ==========
+    data : `bytes`
+        UTF-8 encoded JSON document, whose top level value must be an object.
+    names : iterable of `str`
+        Names of the members to be removed.
+    
+    Returns
+    =======
+    data : `bytes`
+        The document without the members.
+    
+    Raises
+    ======
+    ValueError
+        Raised if `data` is not valid JSON (RFC 8259) encoded as UTF-8, or its top
+        level value is not an object.
+    
+    Notes
+    =====
+    The grammar is stricter than some libraries: for example, the standard
+    library's json accepts ``NaN`` and ``Infinity``, which raise an error here.
+    """
+    data.decode('utf-8')
+    names = set(names)
+    keys = {'"{}"'.format(name).encode('utf-8') for name in names}
+    match = _open.match(data)
+    if match is None:
+        raise ValueError('The top level value must be an object')
+    position = match.end()
+    # Start of the key and end of the value of every member
+    members = []
+    removed = []
+    match = _empty.match(data, position)
+    if match is not None:
+        if match.group(1) != b'}':
+            raise ValueError('Unbalanced brackets at byte {}'.format(match.start(1)))
+        position = match.end()
+    else:
+        while True:
+            match = _member.match(data, position)
+            if match is None:
+                raise ValueError('Invalid JSON at byte {}'.format(position))
+            key = match.group(1)
+            position = match.end()
+            if match.group(3):
+                position = _skipValue(data, position, match.group(3))
+            members.append((match.start(1), position))
+            # Keys written with escape sequences are compared once decoded
+            removed.append(key in keys or (b'\\' in key and json.loads(key.decode('utf-8')) in names))
+            match = _next.match(data, position)
+            if match is None or match.group(1) == b']':
+                raise ValueError('Invalid JSON at byte {}'.format(position))
+            position = match.end()
+            if match.group(1) == b'}':
+                break
+    if _whitespace.match(data, position).end() != len(data):
+        raise ValueError('Extra data after the top level object')
+    
+    if not any(removed):
+        return data
+    # A member is removed up to the key of the next one, and the last ones
+    # from the end of the value that precedes them
+    last = len(members)
+    while last and removed[last - 1]:
+        last -= 1
+    spans = [(members[i][0], members[i + 1][0]) for i in range(last) if removed[i]]
+    if last < len(members):
+        spans.append((members[last - 1][1] if last else members[0][0], members[-1][1]))
+    pieces = []
+    position = 0
+    for spanStart, spanEnd in spans:
+        pieces.append(data[position:spanStart])
+        position = spanEnd
+    pieces.append(data[position:])
+    return b''.join(pieces)
+
+def dumps(content, compact=False, library=None):
+    """Serialize a Python data structure as JSON.
+    
+    Parameters
+    ==========
+    content : Usually `dict` or `list`
+        Python data structure to be serialized.
+    compact : `bool`, optional
+        If True, the JSON is written without indentation or spaces, else it's
+        indented with 2 spaces. Defaults to False.
+    library : {'orjson', 'ujson', 'json'}, optional
+        Library used to serialize `content`. Defaults to `backend`.
+    
+    Returns
+    =======
+    data : `bytes`
+        UTF-8 encoded JSON document.
+    """
+    library = library or backend
+    if library == 'orjson':
+        return orjson.dumps(content) if compact else orjson.dumps(content, option=orjson.OPT_INDENT_2)
+    if library == 'ujson':
+        text = ujson.dumps(content, indent=0 if compact else 2, ensure_ascii=False,
+            escape_forward_slashes=False)
+    elif compact:
+        text = json.dumps(content, separators=(',', ':'))
+    else:
+        text = json.dumps(content, indent=2)
+    return text.encode('utf-8')
@@ -0,0 +1,100 @@
+"""Module with the settings and credentials shared by a provisioning run.
+
+The provisioning scripts need the same information on every run: the contents
+of ``config.yaml``, the credentials of the API account and the ``login`` of
+Grafana's Main admin from ``admins/_superAdmins.yaml``, and a client to make
+requests to Grafana. A `RunContext` loads all of it once per process, and the
+scripts pass it to the functions that need it instead of reading the files again
+or relying on global variables.
+
+Examples
+========
+::
+
+    context = RunContext()
+    orgIds = gapi.getOrgIds(context.user, context.password)
+
+Functions
+=========
+"""
+import threading
+import grafanaAPI as gapi
+import yamlUtility as yutil
+
+
+class RunContext:
+    """Configuration, credentials and API client of a provisioning run.
+    
+    Creating the context configures `grafanaAPI` with `config` and reads
+    ``admins/_superAdmins.yaml`` once.
+    
+    Parameters
+    ----------
+    config : `dict`, optional
+        The contents of ``config.yaml``. Defaults to `yamlUtility.config`.
+    
+    Attributes
+    ----------
+    config : `dict`
+        The contents of ``config.yaml``.
+    provisioningDir : `str`
+        The ``main directory``, where the provisioning configuration is stored.
+    adminsDir : `str`
+        Directory with the configuration of the admin accounts and the first org.
+    superAdmins : `dict`
+        The contents of ``admins/_superAdmins.yaml``.
+    user : `str`
+        ``login`` of the API account, which makes the API requests.
+    password : `str`
+        ``password`` of the API account.
+    mainAdmin : `str`
+        ``login`` of Grafana's Main admin account (id=1).
+    client : `grafanaAPI.GrafanaClient`
+        Client shared by every request made with the API account's credentials.
+    
+    Raises
+    ------
+    FileNotFoundError
+        Raised if ``admins/_superAdmins.yaml`` doesn't exist.
+    yaml.YAMLError
+        Raised if ``admins/_superAdmins.yaml`` does not contain a valid YAML
+        format.
+    """
+    
+    def __init__(self, config=None):
+        if config is None:
+            config = yutil.config
+        self.config = config
+        gapi.configure(config)
+        self.provisioningDir = config['provisioningDir']
+        self.adminsDir = '{}/admins'.format(self.provisioningDir)
+        
+        try:
+            self.superAdmins = yutil.getYamlContent('{}/_superAdmins.yaml'.format(self.adminsDir))
+        except FileNotFoundError as exc:
+            print('The file "{}/_superAdmins.yaml" is missing! Make sure that the directory is set correctly '
+                'in "config.yaml" and that the file has the correct name. It must contain information for the '
+                'two Grafana Admin accounts, the main one (id=1) and the API account which the provisioning '
+                'script should use. See the structure in the documentation and default files.'
+                .format(self.adminsDir))
+            raise exc
+        self.user = self.superAdmins['api']['login']
+        self.password = self.superAdmins['api']['password']
+        self.mainAdmin = self.superAdmins['grafanaAdmin']['data']['login']
+        self.client = gapi.getClient(self.user, self.password)
+        self._apiUserId = None
+        self._lock = threading.Lock()
+    
+    @property
+    def apiUserId(self):
+        """``id`` of the API account in Grafana, looked up the first time it's used.
+        
+        Raises
+        ======
+        grafanaAPI.APIError
+            Raised if the lookup replies with a status code in the 4XX or 5XX range.
+        """
+        with self._lock:
+            if self._apiUserId is None:
+                self._apiUserId = gapi.getExistingUserId(self.user, self.user, self.password)
+            return self._apiUserId
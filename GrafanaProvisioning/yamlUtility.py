@@ -3,13 +3,15 @@
 This module is intended to be used by the Grafana provisioning scripts to read
 information from certain yaml configuration files, and write to others. The 
 functions getYamlContent and writeYamlContent are generic enough so that they 
-can be used with any yaml file. It is implemented with pyyaml 3.13.
+can be used with any yaml file. It is implemented with pyyaml 3.13. Files are
+written with `fileUtility.writeIfChanged`.
 
 Functions
 =========
 """
 import yaml
 import os
+import fileUtility as futil
 
 
 def getYamlContent(file):
@@ -59,6 +61,9 @@ def getYamlContent(file):
 def writeYamlContent(file, data):
     """Write contents of a Python data structure to a YAML file.
     
+    The file is replaced atomically, and it's not written if its content
+    wouldn't change.
+    
     Parameters
     ==========
     file : `str`
@@ -67,18 +72,29 @@ def writeYamlContent(file, data):
         Python data structure to be written in `file`, can be any type of value or
         structure supported by YAML.
     
+    Returns
+    =======
+    written : `bool`
+        True if the file was written, False if it already had the same content or
+        it could not be written.
+    
     Raises
     ======
     PermissionError:
         Raised if the module does not have write permissions on the given file or
         directory.
+    
+    See Also
+    ========
+    fileUtility.writeIfChanged
     """
+    content = yaml.dump(data, default_flow_style=False).encode('utf-8')
     try:
-        with open(file, 'w') as outfile:
-            yaml.dump(data, outfile, default_flow_style=False)
+        return futil.writeIfChanged(file, content)
     except PermissionError as exc:
         print('Could not open {} because this user does not have permission to write to the file.'
             .format(file))
+        return False
 
 
 def loadConfig():
@@ -122,71 +138,10 @@ def loadConfig():
     return config
 
 
-def getSuperAdminLogin():
-    """Obtain the username of Grafana's Main admin account.
-    
-    Returns
-    =======
-    login : `str`
-        Username of Grafana's Main admin account.
-    
-    Raises
-    ======
-    yaml.YAMLError
-        Raised if the super admins file does not contain a valid YAML format.
-    PermissionError:
-        Raised if the module does not have read permissions on the super admins
-        file.
-    FileNotFoundError:
-        Raised if the super admins file doesn't exist or if the file cannot be
-        accessed by the module.
-    
-    See Also
-    ========
-    loadConfig
-    getYamlContent
-    """
-    admins = getYamlContent('{}/admins/_superAdmins.yaml'.format(config['provisioningDir']))
-    return admins['grafanaAdmin']['data']['login']
-
-
-def getApiCredentials():
-    """Return Grafana's main admin's username and password.
-    
-    From the information stored in /admins/_superAdmins.yaml, return the main
-    admin's ``login`` and ``password``. This user should usually have id=1.
-    
-    Returns
-    =======
-    admLogin : `str`
-        Username, or ``login``, of the main Grafana Admin account.
-    admPasswd : `str`
-        ``password`` of the main Grafana Admin account.
-    
-    Raises
-    ======
-    yaml.YAMLError
-        Raised if the super admins file does not contain a valid YAML format.
-    PermissionError:
-        Raised if the module does not have read permissions on the super admins
-        file.
-    FileNotFoundError:
-        Raised if the super admins file doesn't exist or if the file cannot be
-        accessed by the module.
-    
-    See Also
-    ========
-    loadConfig
-    getYamlContent
-    """    
-    # Get API user and password
-    api = getYamlContent('{}/admins/_superAdmins.yaml'.format(config['provisioningDir']))['api']
-    admLogin = api['login']
-    admPasswd = api['password']
-    
-    return (admLogin, admPasswd)
-
-
 config = loadConfig()
 if 'provisioningDir' not in config:
     config['provisioningDir'] = os.path.abspath(os.path.dirname(__file__))
+if 'grafanaProvisioningDir' not in config:
+    config['grafanaProvisioningDir'] = '/etc/grafana/provisioning'
+if 'metricsDir' not in config:
+    config['metricsDir'] = config['provisioningDir']
@@ -0,0 +1,143 @@
+"""Generate a synthetic provisioning directory to benchmark the scripts.
+
+The generated directory has the same structure as the ``main directory`` of the
+project: ``admins/``, ``accounts/``, ``orgs/`` and an ``inputs/`` tree with `N`
+organizations, each of them with `M` accounts and `K` dashboards spread over a
+number of folders. The first organization is the default one (Kiosk), set up
+like in the sample files. Dashboards are copies of the sample dashboards found
+in ``GrafanaProvisioning/inputs/Kiosk/dashboards``, with a different title,
+``id`` and ``uid``.
+
+Example::
+
+    python3 generateWorkload.py /tmp/workload --orgs 100 --accounts 20 --dashboards 30
+
+Functions
+=========
+"""
+import os
+import glob
+import json
+import argparse
+import yaml
+
+_samples = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GrafanaProvisioning', 'inputs',
+    'Kiosk', 'dashboards')
+roles = ('Viewer', 'Editor', 'Admin')
+
+
+def _writeYaml(path, data):
+    with open(path, 'w') as outfile:
+        yaml.dump(data, outfile, default_flow_style=False)
+
+
+def _symlink(target, link):
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(target, link)
+
+
+def loadSampleDashboards():
+    """Return the sample dashboards of the project as a list of `dict`."""
+    dashboards = []
+    for path in sorted(glob.glob('{}/*/*.json'.format(_samples))):
+        with open(path, 'r', encoding='utf-8') as sample:
+            dashboards.append(json.load(sample))
+    return dashboards
+
+
+def generateAdmins(top, adminLogin='grafanaadmin', apiLogin='grafanaApi'):
+    """Write the ``admins/`` files and the Kiosk org, like the sample files."""
+    admins = os.path.join(top, 'admins')
+    os.makedirs(admins, exist_ok=True)
+    _writeYaml(os.path.join(admins, '_superAdmins.yaml'), {
+        'grafanaAdmin': {'password': 'benchmark', 'data': {'login': adminLogin, 'name': 'Grafana Admin',
+            'email': 'gadmin@localhost', 'theme': 'dark'}},
+        'api': {'login': apiLogin, 'password': 'benchmark', 'name': 'Puppet', 'email': 'api@localhost'}})
+    _writeYaml(os.path.join(admins, '_kiosk.yaml'), {'Kiosk': [{'login': 'display', 'role': 'Viewer'}]})
+    _writeYaml(os.path.join(admins, '_kioskAccounts.yaml'), [{'login': 'display', 'password': 'benchmark',
+        'name': 'Kiosk Display', 'email': 'display@localhost'}])
+    for d in ('accounts', 'orgs'):
+        os.makedirs(os.path.join(top, d), exist_ok=True)
+    _symlink('../admins/_kioskAccounts.yaml', os.path.join(top, 'accounts', 'kiosk.yaml'))
+    _symlink('../admins/_kiosk.yaml', os.path.join(top, 'orgs', 'Kiosk_org.yaml'))
+
+
+def generateOrg(top, orgName, accounts, dashboards, folders, samples, prefix):
+    """Write the input directory of one org.
+    
+    Parameters
+    ==========
+    top : `str`
+        Directory where the workload is generated.
+    orgName : `str`
+        Name of the org, also used as the name of its input directory.
+    accounts : `int`
+        Number of accounts provisioned by the org, all of them are members.
+    dashboards : `int`
+        Number of dashboards of the org.
+    folders : `int`
+        Number of folders the dashboards are spread over.
+    samples : `list` of `dict`
+        Dashboards used as templates.
+    prefix : `str`
+        Prefix of the dashboard titles. Orgs with the same prefix get identical
+        dashboards.
+    """
+    orgDir = os.path.join(top, 'inputs', orgName)
+    os.makedirs(orgDir, exist_ok=True)
+    logins = ['{}_user{:04d}'.format(orgName.lower(), i) for i in range(accounts)]
+    _writeYaml(os.path.join(orgDir, 'accounts.yaml'), [{'login': login, 'password': 'benchmark',
+        'name': login, 'email': '{}@localhost'.format(login)} for login in logins] or None)
+    members = [{'login': login, 'role': roles[i % len(roles)]} for i, login in enumerate(logins)]
+    _writeYaml(os.path.join(orgDir, 'org.yaml'), {orgName: members})
+    _writeYaml(os.path.join(orgDir, 'datasources.yaml'), {'apiVersion': 1, 'datasources': [
+        {'name': '{} InfluxDB'.format(orgName), 'type': 'influxdb', 'access': 'proxy',
+        'url': 'http://localhost:8086', 'database': 'telegraf', 'isDefault': True}]})
+    for i in range(dashboards):
+        folder = os.path.join(orgDir, 'dashboards', 'Folder {:02d}'.format(i % folders))
+        os.makedirs(folder, exist_ok=True)
+        dashboard = dict(samples[i % len(samples)])
+        dashboard['id'] = i + 1
+        dashboard['uid'] = '{}{:06d}'.format(prefix, i)[-40:]
+        dashboard['title'] = '{} Dashboard {:04d}'.format(prefix, i)
+        with open(os.path.join(folder, 'dashboard{:04d}.json'.format(i)), 'w', encoding='utf-8') as out:
+            json.dump(dashboard, out, indent=2)
+
+
+def generateWorkload(top, orgs, accounts, dashboards, folders=5, identical=False):
+    """Write a full provisioning directory with `orgs` orgs besides Kiosk.
+    
+    Parameters
+    ==========
+    top : `str`
+        Directory where the workload is generated.
+    orgs : `int`
+        Number of orgs, not counting the Kiosk org.
+    accounts : `int`
+        Number of accounts per org.
+    dashboards : `int`
+        Number of dashboards per org.
+    folders : `int`, optional
+        Number of folders per org. Defaults to 5.
+    identical : `bool`, optional
+        If True, every org gets the same dashboards. Defaults to False.
+    """
+    samples = loadSampleDashboards()
+    generateAdmins(top)
+    generateOrg(top, 'Kiosk', accounts, dashboards, folders, samples, 'Shared' if identical else 'Kiosk')
+    for i in range(orgs):
+        orgName = 'Org{:04d}'.format(i)
+        generateOrg(top, orgName, accounts, dashboards, folders, samples, 'Shared' if identical else orgName)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic provisioning directory.')
+    parser.add_argument('directory', help='Directory where the workload is generated.')
+    parser.add_argument('--orgs', type=int, default=10, help='Number of orgs besides Kiosk.')
+    parser.add_argument('--accounts', type=int, default=10, help='Accounts per org.')
+    parser.add_argument('--dashboards', type=int, default=10, help='Dashboards per org.')
+    parser.add_argument('--folders', type=int, default=5, help='Dashboard folders per org.')
+    parser.add_argument('--identical', action='store_true', help='Use the same dashboards for every org.')
+    args = parser.parse_args()
+    generateWorkload(args.directory, args.orgs, args.accounts, args.dashboards, args.folders, args.identical)
@@ -0,0 +1,128 @@
+"""Benchmark the JSON libraries and output formats used to copy dashboards.
+
+Every dashboard of the corpus is parsed, stripped of its ``id`` and ``uid`` and
+written to a temporary directory, like ``gpInputs.copyDashboardWithoutIds``
+does, with each JSON library that is installed (see `jsonUtility`) and with both
+indented and compact output, and with `jsonUtility.stripMembers`, which removes
+them from the bytes of the file. The time to parse and write the corpus and the
+size of the written files are reported.
+
+The default corpus is ``inputs/*/dashboards`` of the provisioning directory of
+this repository. Example::
+
+    python3 jsonBenchmark.py --repeat 20
+
+Functions
+=========
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import tempfile
+import importlib
+
+_project = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GrafanaProvisioning')
+sys.path.insert(0, _project)
+import jsonUtility as jutil
+
+
+def availableLibraries():
+    """Return the JSON libraries supported by `jsonUtility` that are installed."""
+    libraries = []
+    for library in ('orjson', 'ujson', 'json'):
+        try:
+            importlib.import_module(library)
+        except ImportError:
+            continue
+        libraries.append(library)
+    return libraries
+
+
+def loadCorpus(pattern):
+    """Read every file that matches `pattern` into memory.
+    
+    Parameters
+    ==========
+    pattern : `str`
+        Glob pattern of the dashboards.
+    
+    Returns
+    =======
+    corpus : `list` of `bytes`
+        Content of each dashboard.
+    """
+    corpus = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'rb') as dashboard:
+            corpus.append(dashboard.read())
+    return corpus
+
+
+def measure(corpus, library, compact, outDir, repeat):
+    """Parse and write the corpus `repeat` times with a library and format.
+    
+    Parameters
+    ==========
+    corpus : `list` of `bytes`
+        Content of each dashboard.
+    library : `str`
+        JSON library, see `jsonUtility.loads`, or ``stream`` to remove the
+        members with `jsonUtility.stripMembers`, like gpInputs does unless the
+        output is compact.
+    compact : `bool`
+        If True, the output is not indented.
+    outDir : `str`
+        Directory where the dashboards are written.
+    repeat : `int`
+        Times the whole corpus is processed.
+    
+    Returns
+    =======
+    result : `dict`
+        Seconds spent parsing and writing the corpus once (best of `repeat`), and
+        total size in bytes of the written files.
+    """
+    best = None
+    for _ in range(repeat):
+        size = 0
+        start = time.perf_counter()
+        for i, raw in enumerate(corpus):
+            if library == 'stream':
+                content = jutil.stripMembers(raw, ('id', 'uid'))
+            else:
+                data = jutil.loads(raw, library)
+                data.pop('id', None)
+                data.pop('uid', None)
+                content = jutil.dumps(data, compact, library)
+            with open(os.path.join(outDir, '{}.json'.format(i)), 'wb') as dashboard:
+                dashboard.write(content)
+            size += len(content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'library': library, 'compact': compact, 'seconds': best, 'bytes': size}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the JSON libraries used to copy dashboards.')
+    parser.add_argument('--corpus', default=os.path.join(_project, 'inputs', '*', 'dashboards', '*', '*.json'),
+        help='Glob pattern of the dashboards to process.')
+    parser.add_argument('--repeat', type=int, default=10, help='Times the corpus is processed.')
+    args = parser.parse_args()
+    
+    corpus = loadCorpus(args.corpus)
+    if not corpus:
+        sys.exit('No dashboards match {}'.format(args.corpus))
+    inputSize = sum(len(raw) for raw in corpus)
+    print('{} dashboards, {:.1f} KiB, default library: {}'.format(len(corpus), inputSize / 1024,
+        jutil.backend))
+    
+    with tempfile.TemporaryDirectory(prefix='gpJsonBenchmark') as outDir:
+        for library in ['stream'] + availableLibraries():
+            # The stream keeps the format of the input
+            for compact in (False,) if library == 'stream' else (False, True):
+                result = measure(corpus, library, compact, outDir, args.repeat)
+                print('{:>6} | {:>8} | {:8.2f} ms | {:6.1f} MiB/s | {:8.1f} KiB written'.format(
+                    library, 'compact' if compact else 'indented', result['seconds'] * 1000,
+                    inputSize / result['seconds'] / 2**20, result['bytes'] / 1024))
@@ -0,0 +1,388 @@
+"""Local stand-in for Grafana's HTTP API, used to benchmark the provisioning.
+
+This module implements, in memory, the endpoints of Grafana's API that are used
+by `grafanaAPI`, so that the provisioning scripts can be run and measured at
+scale without a real Grafana installation. Every request can be delayed by a
+configurable latency to simulate the round trip to Grafana, and the server
+counts the requests made to each endpoint.
+
+The initial state is the one left by ``gpSetup.py``: the main admin (id=1), the
+API account (id=2) and the first organization (id=1), renamed to `kioskName`.
+
+By default the server answers like Grafana 5.4, the version the scripts target,
+which doesn't have the paginated ``orgs/{id}/users/search`` endpoint of newer
+versions and ignores the pagination of ``orgs``. Both can be enabled with
+``--org-users-search``.
+
+It can be run on its own, for example to replace Grafana on port 3000::
+
+    python3 mockGrafana.py --port 3000 --latency 0.005
+
+Functions
+=========
+"""
+import re
+import sys
+import json
+import socket
+import time
+import base64
+import argparse
+import threading
+import socketserver
+import http.server
+import urllib.parse
+
+
+class GrafanaState:
+    """In memory users and organizations of the mock Grafana server.
+    
+    Parameters
+    ----------
+    adminLogin : `str`
+        ``login`` of the main admin account (id=1).
+    apiLogin : `str`
+        ``login`` of the API account (id=2), which is a Grafana Admin.
+    kioskName : `str`
+        Name of the first organization (id=1).
+    """
+    
+    def __init__(self, adminLogin='grafanaadmin', apiLogin='grafanaApi', kioskName='Kiosk'):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.orgs = {}
+        # members[orgId][userId] = role
+        self.members = {}
+        self.nextUserId = 1
+        self.nextOrgId = 1
+        self.createOrg(kioskName)
+        self.createUser({'login': adminLogin, 'email': 'gadmin@localhost', 'name': 'Grafana Admin'})
+        self.createUser({'login': apiLogin, 'email': 'api@localhost', 'name': 'Puppet'})
+        self.members[1][1] = 'Admin'
+    
+    def createUser(self, data):
+        """Create a user, which is added to the first org like Grafana does."""
+        userId = self.nextUserId
+        self.nextUserId += 1
+        self.users[userId] = {'id': userId, 'login': data['login'], 'email': data.get('email', ''),
+            'name': data.get('name', ''), 'isAdmin': False}
+        self.members[1][userId] = 'Viewer'
+        return userId
+    
+    def createOrg(self, name):
+        """Create an org without members."""
+        orgId = self.nextOrgId
+        self.nextOrgId += 1
+        self.orgs[orgId] = {'id': orgId, 'name': name}
+        self.members[orgId] = {}
+        return orgId
+    
+    def findUser(self, loginOrEmail):
+        """Return the user with the given login or email, or None."""
+        for u in self.users.values():
+            if u['login'] == loginOrEmail:
+                return u
+        for u in self.users.values():
+            if u['email'] == loginOrEmail:
+                return u
+        return None
+
+
+class MockGrafanaServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded HTTP server that answers like Grafana's API.
+    
+    Parameters
+    ----------
+    address : `tuple`
+        Host and port where the server listens, port 0 picks a free port.
+    state : `GrafanaState`
+        Users and organizations that the server starts with.
+    latency : `float`
+        Seconds that every request is delayed before replying.
+    orgUsersSearch : `bool`, optional
+        If True, the server has the ``orgs/{id}/users/search`` endpoint of Grafana
+        6.2 and newer and paginates ``orgs``, else it replies to the endpoint with
+        a 404 and to ``orgs`` with up to 1000 orgs, like Grafana 5.4. Defaults to
+        False.
+    """
+    daemon_threads = True
+    
+    def __init__(self, address, state, latency=0, orgUsersSearch=False):
+        super().__init__(address, MockGrafanaHandler)
+        self.state = state
+        self.latency = latency
+        self.orgUsersSearch = orgUsersSearch
+        self.statsLock = threading.Lock()
+        self.resetStats()
+    
+    @property
+    def url(self):
+        """Base url of the API, to be used as `grafanaAPI.url`."""
+        return 'http://{}:{}/api/'.format(self.server_address[0], self.server_address[1])
+    
+    def resetStats(self):
+        """Reset the request counters."""
+        with self.statsLock:
+            self.requests = {}
+            self.connections = 0
+    
+    def count(self, endpoint):
+        """Count a request to an endpoint template like ``GET orgs/{id}``."""
+        with self.statsLock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+    
+    def stats(self):
+        """Return the number of connections and of requests per endpoint."""
+        with self.statsLock:
+            return {'connections': self.connections, 'requests': dict(self.requests)}
+    
+    def startInThread(self):
+        """Serve requests on a daemon thread and return the server."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def endpointTemplate(method, path):
+    """Return the endpoint of a request with its variable parts replaced.
+    
+    Parameters
+    ==========
+    method : `str`
+        HTTP method of the request.
+    path : `str`
+        Path of the request after ``/api/``, with its query string.
+    
+    Returns
+    =======
+    endpoint : `str`
+        For example ``GET users/{id}/orgs`` for ``users/5/orgs``.
+    """
+    path = urllib.parse.urlsplit(path).path
+    path = re.sub(r'^orgs/name/.*$', 'orgs/name/{name}', path)
+    path = re.sub(r'(^|/)\d+(?=/|$)', r'\1{id}', path)
+    return '{} {}'.format(method, path)
+
+
+class MockGrafanaHandler(http.server.BaseHTTPRequestHandler):
+    """Request handler that implements the endpoints used by `grafanaAPI`."""
+    protocol_version = 'HTTP/1.1'
+    
+    routes = [
+        ('GET', r'users/search', 'searchUsers'),
+        ('GET', r'users/lookup', 'lookupUser'),
+        ('GET', r'users/(\d+)/orgs', 'getUserOrgs'),
+        ('POST', r'users/(\d+)/using/(\d+)', 'switchOrg'),
+        ('PUT', r'users/(\d+)', 'updateUser'),
+        ('POST', r'admin/users', 'createUser'),
+        ('PUT', r'admin/users/(\d+)/password', 'ok'),
+        ('PUT', r'admin/users/(\d+)/permissions', 'setPermissions'),
+        ('GET', r'orgs', 'getOrgs'),
+        ('POST', r'orgs', 'createOrg'),
+        ('GET', r'orgs/name/(.+)', 'getOrgByName'),
+        ('PUT', r'orgs/(\d+)', 'updateOrg'),
+        ('GET', r'orgs/(\d+)/users', 'getOrgUsers'),
+        ('GET', r'orgs/(\d+)/users/search', 'searchOrgUsers'),
+        ('POST', r'orgs/(\d+)/users', 'addOrgUser'),
+        ('PATCH', r'orgs/(\d+)/users/(\d+)', 'updateOrgUser'),
+        ('DELETE', r'orgs/(\d+)/users/(\d+)', 'removeOrgUser'),
+    ]
+    
+    def setup(self):
+        super().setup()
+        # Like Grafana, reply without waiting for the client's ACK (Nagle's algorithm)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.statsLock:
+            self.server.connections += 1
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _handle(self):
+        api = self.path[len('/api/'):] if self.path.startswith('/api/') else self.path
+        split = urllib.parse.urlsplit(api)
+        self.query = {k: v[0] for k, v in urllib.parse.parse_qs(split.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+        
+        self.server.count(endpointTemplate(self.command, api))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        
+        self.login = None
+        auth = self.headers.get('Authorization', '')
+        if auth.startswith('Basic '):
+            self.login = base64.b64decode(auth[6:]).decode('utf-8').split(':', 1)[0]
+        
+        path = urllib.parse.unquote(split.path)
+        for method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if method == self.command and match:
+                with self.server.state.lock:
+                    code, data = getattr(self, handler)(self.server.state, *match.groups())
+                return self._reply(code, data)
+        self._reply(404, {'message': 'Not found'})
+    
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+    
+    def _reply(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _page(self, items, defaultPerPage):
+        perPage = int(self.query.get('perpage', defaultPerPage))
+        page = int(self.query.get('page', 1))
+        return items[(page - 1) * perPage:page * perPage], page, perPage
+    
+    def ok(self, state, *args):
+        return 200, {'message': 'OK'}
+    
+    def searchUsers(self, state):
+        query = self.query.get('query', '')
+        users = [u for u in state.users.values()
+            if query in u['login'] or query in u['email'] or query in u['name']]
+        page, number, perPage = self._page(users, 1000)
+        return 200, {'totalCount': len(users), 'users': page, 'page': number, 'perPage': perPage}
+    
+    def lookupUser(self, state):
+        u = state.findUser(self.query.get('loginOrEmail', ''))
+        if u is None:
+            return 404, {'message': 'User not found'}
+        return 200, u
+    
+    def getUserOrgs(self, state, userId):
+        userId = int(userId)
+        if userId not in state.users:
+            return 404, {'message': 'User not found'}
+        return 200, [{'orgId': orgId, 'name': state.orgs[orgId]['name'], 'role': members[userId]}
+            for orgId, members in state.members.items() if userId in members]
+    
+    def switchOrg(self, state, userId, orgId):
+        if int(userId) not in state.users:
+            return 404, {'message': 'User not found'}
+        if int(userId) not in state.members.get(int(orgId), {}):
+            return 401, {'message': 'Not a valid organization'}
+        return 200, {'message': 'Active organization changed'}
+    
+    def updateUser(self, state, userId):
+        u = state.users.get(int(userId))
+        if u is None:
+            return 404, {'message': 'User not found'}
+        u.update({k: v for k, v in self.body.items() if k in ('login', 'email', 'name')})
+        return 200, {'message': 'User updated'}
+    
+    def createUser(self, state):
+        if state.findUser(self.body['login']) is not None:
+            return 412, {'message': 'User with same email or login already exists'}
+        userId = state.createUser(self.body)
+        return 200, {'id': userId, 'message': 'User created'}
+    
+    def setPermissions(self, state, userId):
+        u = state.users.get(int(userId))
+        if u is None:
+            return 404, {'message': 'User not found'}
+        u['isAdmin'] = bool(self.body.get('isGrafanaAdmin'))
+        return 200, {'message': 'User permissions updated'}
+    
+    def getOrgs(self, state):
+        orgs = list(state.orgs.values())
+        if not self.server.orgUsersSearch:
+            return 200, orgs[:1000]
+        orgs, page, perPage = self._page(orgs, 1000)
+        return 200, orgs
+    
+    def createOrg(self, state):
+        name = self.body['name']
+        if any(o['name'] == name for o in state.orgs.values()):
+            return 409, {'message': 'Organization name taken'}
+        orgId = state.createOrg(name)
+        # The user that creates the org is added to it as Admin
+        creator = state.findUser(self.login)
+        if creator is not None:
+            state.members[orgId][creator['id']] = 'Admin'
+        return 200, {'orgId': orgId, 'message': 'Organization created'}
+    
+    def getOrgByName(self, state, name):
+        for org in state.orgs.values():
+            if org['name'] == name:
+                return 200, dict(org, address={})
+        return 404, {'message': 'Organization not found'}
+    
+    def updateOrg(self, state, orgId):
+        org = state.orgs.get(int(orgId))
+        if org is None:
+            return 404, {'message': 'Organization not found'}
+        org['name'] = self.body['name']
+        return 200, {'message': 'Organization updated'}
+    
+    def _orgUsers(self, state, orgId):
+        return [{'orgId': orgId, 'userId': userId, 'login': state.users[userId]['login'],
+            'email': state.users[userId]['email'], 'role': role}
+            for userId, role in sorted(state.members[orgId].items())]
+    
+    def getOrgUsers(self, state, orgId):
+        orgId = int(orgId)
+        if orgId not in state.orgs:
+            return 404, {'message': 'Organization not found'}
+        return 200, self._orgUsers(state, orgId)
+    
+    def searchOrgUsers(self, state, orgId):
+        if not self.server.orgUsersSearch:
+            return 404, {'message': 'Not found'}
+        orgId = int(orgId)
+        if orgId not in state.orgs:
+            return 404, {'message': 'Organization not found'}
+        users = self._orgUsers(state, orgId)
+        page, number, perPage = self._page(users, 1000)
+        return 200, {'totalCount': len(users), 'orgUsers': page, 'page': number, 'perPage': perPage}
+    
+    def addOrgUser(self, state, orgId):
+        orgId = int(orgId)
+        if orgId not in state.orgs:
+            return 404, {'message': 'Organization not found'}
+        u = state.findUser(self.body['loginOrEmail'])
+        if u is None:
+            return 404, {'message': 'User not found'}
+        if u['id'] in state.members[orgId]:
+            return 409, {'message': 'User is already member of this organization'}
+        state.members[orgId][u['id']] = self.body['role']
+        return 200, {'message': 'User added to organization'}
+    
+    def updateOrgUser(self, state, orgId, userId):
+        members = state.members.get(int(orgId), {})
+        if int(userId) not in members:
+            return 404, {'message': 'User not found'}
+        members[int(userId)] = self.body['role']
+        return 200, {'message': 'Organization user updated'}
+    
+    def removeOrgUser(self, state, orgId, userId):
+        members = state.members.get(int(orgId), {})
+        if int(userId) not in members:
+            return 404, {'message': 'User not found'}
+        del members[int(userId)]
+        return 200, {'message': 'User removed from organization'}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a mock of Grafana\'s API.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds to delay each request.')
+    parser.add_argument('--org-users-search', action='store_true',
+        help='Serve orgs/{id}/users/search and paginate orgs like Grafana 6.2 and newer.')
+    parser.add_argument('--admin', default='grafanaadmin', help='Login of the main admin (id=1).')
+    parser.add_argument('--api', default='grafanaApi', help='Login of the API account (id=2).')
+    args = parser.parse_args()
+    
+    server = MockGrafanaServer((args.host, args.port), GrafanaState(args.admin, args.api), args.latency,
+        args.org_users_search)
+    print('Mock Grafana API listening on {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats(), indent=2, sort_keys=True))
+        sys.exit(0)
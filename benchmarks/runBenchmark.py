@@ -0,0 +1,156 @@
+"""Benchmark the provisioning scripts against the mock Grafana API.
+
+A synthetic provisioning directory is generated with `generateWorkload` in a
+temporary directory, together with a copy of the scripts and a ``config.yaml``
+that points them to a `mockGrafana` server and to directories inside the
+temporary one. Each script is then run in its own process, and its wall time,
+number of requests per endpoint and peak RSS are reported.
+
+The scripts are run `runs` times in a row: the first run provisions everything
+from scratch, and the next ones measure the usual Puppet run where nothing
+changed.
+
+Example::
+
+    python3 runBenchmark.py --orgs 100 --accounts 20 --dashboards 30 --latency 0.005
+
+Functions
+=========
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import yaml
+import mockGrafana
+import generateWorkload
+
+_project = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GrafanaProvisioning')
+scripts = ('gpInputs.py', 'gpAccounts.py')
+
+
+def prepareDirectory(top, serverUrl, args):
+    """Copy the scripts to `top`, generate the workload and write the config.
+    
+    Parameters
+    ==========
+    top : `str`
+        Temporary directory where the provisioning will run.
+    serverUrl : `str`
+        Url of the mock Grafana API.
+    args : `argparse.Namespace`
+        Size of the workload, see `generateWorkload.generateWorkload`.
+    """
+    for path in glob.glob('{}/*.py'.format(_project)) + ['{}/dbRoutesTemplate.yaml'.format(_project)]:
+        shutil.copy(path, top)
+    generateWorkload.generateWorkload(top, args.orgs, args.accounts, args.dashboards, args.folders,
+        args.identical)
+    
+    with open('{}/config.yaml'.format(_project), 'r') as stream:
+        config = yaml.safe_load(stream)
+    config.update({
+        'provisioningDir': top,
+        'dashboardsDir': os.path.join(top, 'dashboards'),
+        'grafanaProvisioningDir': os.path.join(top, 'grafana'),
+        'grafanaUrl': serverUrl,
+    })
+    for path in (config['dashboardsDir'], os.path.join(top, 'grafana', 'datasources'),
+            os.path.join(top, 'grafana', 'dashboards')):
+        os.makedirs(path, exist_ok=True)
+    with open(os.path.join(top, 'config.yaml'), 'w') as outfile:
+        yaml.dump(config, outfile, default_flow_style=False)
+
+
+def runScript(top, script, server):
+    """Run one of the scripts in its own process and measure it.
+    
+    Parameters
+    ==========
+    top : `str`
+        Directory where the scripts and the workload are.
+    script : `str`
+        File name of the script.
+    server : `mockGrafana.MockGrafanaServer`
+        Server whose request counters are measured.
+    
+    Returns
+    =======
+    result : `dict`
+        Wall time in seconds, peak RSS in KiB, exit code, number of connections
+        and number of requests per endpoint.
+    """
+    server.resetStats()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(top, script)], cwd=top,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    wallTime = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') \
+        else status >> 8
+    stats = server.stats()
+    if process.returncode != 0:
+        print(output.decode('utf-8', 'replace'))
+    return {
+        'script': script,
+        'exitCode': process.returncode,
+        'wallTime': wallTime,
+        # ru_maxrss is in KiB on Linux
+        'peakRss': usage.ru_maxrss,
+        'connections': stats['connections'],
+        'totalRequests': sum(stats['requests'].values()),
+        'requests': stats['requests'],
+    }
+
+
+def printResult(run, result):
+    """Print the measurements of a script run."""
+    print('Run {} | {} | exit {} | {:.2f} s | {:.1f} MiB peak RSS | {} requests | {} connections'.format(
+        run, result['script'], result['exitCode'], result['wallTime'], result['peakRss'] / 1024,
+        result['totalRequests'], result['connections']))
+    for endpoint, count in sorted(result['requests'].items(), key=lambda item: -item[1]):
+        print('    {:>7}  {}'.format(count, endpoint))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the provisioning scripts with a mock Grafana.')
+    parser.add_argument('--orgs', type=int, default=50, help='Number of orgs besides Kiosk.')
+    parser.add_argument('--accounts', type=int, default=20, help='Accounts per org.')
+    parser.add_argument('--dashboards', type=int, default=20, help='Dashboards per org.')
+    parser.add_argument('--folders', type=int, default=5, help='Dashboard folders per org.')
+    parser.add_argument('--identical', action='store_true', help='Use the same dashboards for every org.')
+    parser.add_argument('--latency', type=float, default=0.002, help='Seconds to delay each request.')
+    parser.add_argument('--org-users-search', action='store_true',
+        help='Serve orgs/{id}/users/search and paginate orgs like Grafana 6.2 and newer, instead of like 5.4.')
+    parser.add_argument('--runs', type=int, default=2, help='Times each script is run in a row.')
+    parser.add_argument('--scripts', nargs='+', default=scripts, help='Scripts to run, in order.')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary directory.')
+    parser.add_argument('--json', help='Write the results to this file as JSON.')
+    args = parser.parse_args()
+    
+    top = tempfile.mkdtemp(prefix='gpBenchmark')
+    server = mockGrafana.MockGrafanaServer(('127.0.0.1', 0), mockGrafana.GrafanaState(),
+        args.latency, args.org_users_search).startInThread()
+    try:
+        prepareDirectory(top, server.url, args)
+        results = []
+        for run in range(1, args.runs + 1):
+            for script in args.scripts:
+                result = runScript(top, script, server)
+                result['run'] = run
+                results.append(result)
+                printResult(run, result)
+        if args.json:
+            with open(args.json, 'w') as outfile:
+                json.dump({'parameters': vars(args), 'results': results}, outfile, indent=2)
+    finally:
+        server.shutdown()
+        if args.keep:
+            print('Provisioning directory kept at {}'.format(top))
+        else:
+            shutil.rmtree(top)
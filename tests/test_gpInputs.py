@@ -0,0 +1,98 @@
+"""Tests of the dashboard provisioning of gpInputs."""
+import os
+import sys
+import json
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GrafanaProvisioning'))
+import gpInputs
+
+
+class ProvisionDashboardsTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.inputDir = os.path.join(self.tmp.name, 'inputs', 'org')
+        self.dashboardsDir = os.path.join(self.tmp.name, 'dashboards')
+        os.makedirs(os.path.join(self.inputDir, 'dashboards', 'folder'))
+        os.makedirs(os.path.join(self.dashboardsDir, 'org', 'folder'))
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def writeInput(self, name, content):
+        with open(os.path.join(self.inputDir, 'dashboards', 'folder', name), 'w') as dashboard:
+            json.dump(content, dashboard)
+    
+    def provision(self, compact=False):
+        return gpInputs.provisionDashboards('org', ['folder'], self.inputDir, self.dashboardsDir,
+            compact=compact)
+    
+    def testCompactChangeRewritesDashboards(self):
+        """Changing compactDashboards rewrites the dashboards that didn't change."""
+        self.writeInput('a.json', {'id': 1, 'title': 'a', 'panels': []})
+        self.provision()
+        counts = self.provision(compact=True)
+        self.assertEqual(counts['copied'], 1)
+        with open(os.path.join(self.dashboardsDir, 'org', 'folder', 'a.json'), 'rb') as dashboard:
+            self.assertNotIn(b'\n', dashboard.read().strip())
+        self.assertEqual(self.provision(compact=True)['skipped'], 1)
+    
+    def testRelinkedDashboardIsNewer(self):
+        """A dashboard changed to content already in the store gets a new mtime."""
+        self.writeInput('a.json', {'id': 1, 'title': 'a'})
+        self.writeInput('b.json', {'id': 2, 'title': 'b'})
+        self.provision()
+        
+        # Make every provisioned file old, like after a previous run
+        past = time.time() - 3600
+        for name in ('a.json', 'b.json'):
+            os.utime(os.path.join(self.dashboardsDir, 'org', 'folder', name), (past, past))
+        
+        start = time.time()
+        self.writeInput('a.json', {'id': 1, 'title': 'b'})
+        counts = self.provision()
+        self.assertEqual(counts['copied'], 1)
+        
+        dest = os.path.join(self.dashboardsDir, 'org', 'folder', 'a.json')
+        other = os.path.join(self.dashboardsDir, 'org', 'folder', 'b.json')
+        self.assertTrue(os.path.samefile(dest, other))
+        self.assertGreaterEqual(os.stat(dest).st_mtime, start - 1)
+    
+    def testNewLinkKeepsOtherLinksTime(self):
+        """Provisioning a copy of a stored dashboard doesn't touch its other links."""
+        self.writeInput('a.json', {'id': 1, 'title': 'a'})
+        self.provision()
+        
+        past = time.time() - 3600
+        dest = os.path.join(self.dashboardsDir, 'org', 'folder', 'a.json')
+        os.utime(dest, (past, past))
+        
+        self.writeInput('b.json', {'id': 2, 'title': 'a'})
+        self.assertEqual(self.provision()['copied'], 1)
+        other = os.path.join(self.dashboardsDir, 'org', 'folder', 'b.json')
+        self.assertTrue(os.path.samefile(dest, other))
+        self.assertAlmostEqual(os.stat(dest).st_mtime, past, delta=1)
+
+    
+    def testMalformedDashboardFallsBack(self):
+        """A dashboard rejected by stripMembers is parsed by the JSON library."""
+        self.writeInput('a.json', {'id': 1, 'title': 'a', 'panels': [{'id': 2}]})
+        with mock.patch.object(gpInputs.jutil, 'stripMembers', side_effect=ValueError):
+            self.assertEqual(self.provision()['copied'], 1)
+        with open(os.path.join(self.dashboardsDir, 'org', 'folder', 'a.json'), 'rb') as dashboard:
+            self.assertEqual(json.loads(dashboard.read()), {'title': 'a', 'panels': [{'id': 2}]})
+    
+    def testInvalidDashboard(self):
+        """A dashboard that is not valid JSON raises ValueError."""
+        with open(os.path.join(self.inputDir, 'dashboards', 'folder', 'a.json'), 'w') as dashboard:
+            dashboard.write('{"id": 1, "title": ')
+        with self.assertRaises(ValueError):
+            self.provision()
+
+
+if __name__ == '__main__':
+    unittest.main()
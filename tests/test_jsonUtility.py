@@ -0,0 +1,47 @@
+"""Tests of the JSON utilities."""
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GrafanaProvisioning'))
+import jsonUtility as jutil
+
+
+class StripMembersTest(unittest.TestCase):
+    
+    def strip(self, data):
+        return jutil.stripMembers(data, ('id', 'uid'))
+    
+    def testKeepsNestedIds(self):
+        """Only the members of the top level object are removed."""
+        data = b'{"id": 1, "panels": [{"id": 2, "targets": [{"uid": "a"}]}], "uid": "b", "title": "t"}'
+        self.assertEqual(self.strip(data), b'{"panels": [{"id": 2, "targets": [{"uid": "a"}]}], "title": "t"}')
+    
+    def testKeepsFormatting(self):
+        """The bytes outside of the removed members are not changed."""
+        data = b'{\n  "title": "\xc3\xa9",\n  "id": 1,\n  "rows": [ ],\n  "uid": null\n}\n'
+        self.assertEqual(self.strip(data), b'{\n  "title": "\xc3\xa9",\n  "rows": [ ]\n}\n')
+    
+    def testRemovesEveryMember(self):
+        """An object with only removed members becomes empty."""
+        self.assertEqual(json.loads(self.strip(b'{"id": 1, "uid": {"id": 2}}')), {})
+        self.assertEqual(self.strip(b'{}'), b'{}')
+    
+    def testEscapedKeys(self):
+        """Keys written with escape sequences are compared once decoded."""
+        data = b'{"\\u0069d": 1, "u\\u0069d": "a", "title": "\\"id\\""}'
+        self.assertEqual(json.loads(self.strip(data)), {'title': '"id"'})
+    
+    def testMalformed(self):
+        """Documents that are not valid JSON objects raise ValueError."""
+        for data in (b'{"id": 1,}', b'{"a": [1,]}', b'{"a": 01}', b'{"a": tru}', b'{"a": NaN}',
+                b'{"a" 1}', b'{"a": [}', b'{"a": {"b": 1 "c": 2}}', b'{"a": "\\x"}', b'{"a": "\x01"}',
+                b'{"a": "\xff"}', b'{"a": 1} x', b'[{"id": 1}]', b'{"a": [[]', b''):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    self.strip(data)
+
+
+if __name__ == '__main__':
+    unittest.main()